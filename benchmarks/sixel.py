@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Time the sixel encoding of a 400x225 thumbnail.
+
+Needs numpy.  Run it from the top of the source tree:
+
+    python benchmarks/sixel.py
+"""
+
+import sys
+import timeit
+from os.path import abspath, dirname
+
+import numpy
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from ycp.misc.img_display import sixel_encode, sixel_quantize  # noqa: E402
+
+WIDTH, HEIGHT = 400, 225
+NUMBER = 50
+
+
+def thumbnail():
+    """A smooth gradient, the worst case for dithering"""
+    y, x = numpy.mgrid[0:HEIGHT, 0:WIDTH]
+    return numpy.stack([x * 255 // WIDTH, y * 255 // HEIGHT, (x + y) % 256],
+                       axis=-1).astype(numpy.uint8)
+
+
+def main():
+    pixels = thumbnail()
+    for dithering in ('ordered', 'none'):
+        indices = sixel_quantize(pixels, dithering)
+        for label, func in (('quantize', lambda: sixel_quantize(pixels, dithering)),
+                            ('encode', lambda: sixel_encode(indices))):
+            seconds = min(timeit.repeat(func, number=NUMBER, repeat=3))
+            print('{0:<8} {1:<9} {2:8.2f} ms'.format(
+                dithering, label, seconds / NUMBER * 1e3))
+        print('{0:<8} {1:<9} {2:8d} bytes'.format(
+            dithering, 'output', len(sixel_encode(indices))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Time the WideString operations used to lay out a row of the browser.
+
+Run it from the top of the source tree:
+
+    python benchmarks/widestring.py
+"""
+
+import sys
+import timeit
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from ycp.misc.widestring import WideString, uwid  # noqa: E402
+
+TITLES = {
+    'ascii': ["Lecture %02d - Introduction to Algorithms (1080p).mp4" % i
+              for i in range(200)],
+    'cjk': ["第%02d話 モヒカン族の逆襲 【高画質】.mp4" % i for i in range(200)],
+}
+WIDTH = 40
+NUMBER = 200
+
+
+def layout(titles):
+    """What BrowserColumn does for every row: measure, cut, measure again"""
+    for title in titles:
+        wtext = WideString(title)
+        if len(wtext) > WIDTH:
+            wtext = wtext[:WIDTH - 5] + "~.mp4"
+        uwid(str(wtext))
+
+
+def main():
+    for name, titles in TITLES.items():
+        for label, func in (('uwid', lambda: [uwid(t) for t in titles]),
+                            ('len', lambda: [len(WideString(t)) for t in titles]),
+                            ('layout', lambda: layout(titles))):
+            seconds = min(timeit.repeat(func, number=NUMBER, repeat=3))
+            per_row = seconds / NUMBER / len(titles) * 1e6
+            print('{0:<6} {1:<7} {2:8.2f} us/row'.format(name, label, per_row))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,35 @@
 # -*- coding: utf-8 -*-
+from time import perf_counter
+_IMPORT_START = perf_counter()  # Start of the "imports" phase of --startup-report
+
 import os
 import sys
+import signal
 import locale
 import pwd
 import socket
-import tempfile
 import mimetypes
+from argparse import ArgumentParser
 from collections import deque
+from functools import cache
 import subprocess
-import cProfile
-import pstats
 import traceback
 
+from .config import commands
 from .config.settings import Settings
 from .services.loader import Loader
 from .services.metadata import MetadataManager
+from .services.copy_buffer import CopyBuffer
 from .services.signals import SignalDispatcher
 from .services.shared import VideoManagerAware, SettingsAware
+from .services.commands import CommandContainer
+from .services.event_loop import EventLoop
 from .gui.ui import UI
+from .gui.frame_scheduler import FrameScheduler
 from .gui.tab import TabManager
+from .misc.img_display import get_image_displayer
+from .misc.startup_report import StartupReport
+from .misc.sampling_profiler import SamplingProfiler
 # from .misc.keybinding_parser import SPECIAL_KEYS, VERY_SPECIAL_KEYS
 
 
@@ -35,6 +46,7 @@ VERSION_MSG = [
 ]
 
 
+@cache
 def version_helper():
     if __release__:
         version_string = 'ycp {0}'.format(__version__)
@@ -57,9 +69,9 @@ def version_helper():
 
 # Constants
 YCPDIR = os.path.dirname(__file__)
-VERSION = version_helper()
 PY3 = sys.version_info[0] >= 3
 MAX_RESTORABLE_TABS = 3
+DEFAULT_IDLE_DELAY = 2000  # ms between the redraws of an idle ycp
 LEVEL = 'YCP_LEVEL'
 
 # These variables are ignored if the corresponding
@@ -71,6 +83,14 @@ DATADIR = os.path.expanduser('~/.local/share/ycp')
 args = None  # FIXME: arguments from console
 
 
+def __getattr__(name):
+    # VERSION runs "git describe", so it is computed on first access
+    # instead of on every import.
+    if name == 'VERSION':
+        return version_helper()
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
 class App(SignalDispatcher):
     """Main class of app"""
 
@@ -84,12 +104,18 @@ class App(SignalDispatcher):
         self.restorable_tabs = deque([], MAX_RESTORABLE_TABS)
         self.default_linemodes = deque()
         self.loader = Loader()
-        self.copy_buffer = set()
+        self.event_loop = EventLoop()
+        self.frame_scheduler = FrameScheduler(self.event_loop.wakeup)
+        self.copy_buffer = CopyBuffer()
         self.metadata = MetadataManager()
         self.image_displayer = None
         self.run = None
         self.settings = None
         self.expectedtab = None
+        self.startup_report = None
+        self.profiler = None
+        self.commands = CommandContainer()
+        self.commands.load_commands_from_module(commands)
 
         try:
             self.username = pwd.getpwuid(os.getuid()).pw_name
@@ -118,9 +144,84 @@ class App(SignalDispatcher):
         # FIXME: add statement about clean option
         # TODO: add bookmarks/tags functionality
 
+        if self.settings is None:
+            self.settings = SettingsAware.settings
+        self.image_displayer = get_image_displayer(self.settings.preview_images_method)
+        self.settings.signal_bind('setopt.preview_images_method',
+                                  self._set_image_displayer)
+
         self.ui.setup_curses()
         self.ui.initialize()
 
+    def _set_image_displayer(self, signal):
+        if self.image_displayer:
+            self.image_displayer.quit()
+        self.image_displayer = get_image_displayer(signal.value)
+
+    def loop(self):
+        """Draw the UI and handle input until ycp exits."""
+        ui = self.ui
+        loop = self.event_loop
+        frames = self.frame_scheduler
+        loop.add_reader(sys.stdin.fileno(), ui.handle_input)
+        loop.add_signal_handler(signal.SIGWINCH, ui.handle_resize)
+        self._idle_refresh()
+        frames.begin_frame()
+        ui.redraw()
+        frames.frame_rendered()
+        if self.startup_report is not None:
+            self.startup_report.mark('first frame')
+        while True:
+            ui.draw_images()
+            # Sleep until there is input, a timer, a worker wakes us up or
+            # a background frame that was held back is due
+            loop.run_once(0 if ui.load_mode else frames.timeout())
+            if frames.frame_due():
+                frames.begin_frame()
+                ui.redraw()
+                frames.frame_rendered()
+
+    def _idle_refresh(self):
+        """Ask for a frame every idle_delay ms, even without any events.
+
+        Drawing is what reloads directories and bookmarks that changed on
+        disk, so an idle ycp still catches up with them.
+        """
+        self.frame_scheduler.request()
+        delay = max(100, self.settings.idle_delay or DEFAULT_IDLE_DELAY)
+        self.event_loop.call_later(delay / 1000, self._idle_refresh)
+
+    def notify(self, text, duration=4, bad=False, exception=None):
+        """Show a message in the status bar, or on stderr before the UI is up."""
+        if exception is not None:
+            text = '{0}: {1}'.format(text, exception)
+        text = str(text)
+        if self.ui.is_on:
+            self.ui.status.notify(text, duration=duration, bad=bad)
+        else:
+            sys.stderr.write(text + '\n')
+
+    def execute_console(self, string='', wildcards=None, quantifier=None):
+        """Execute a command line as if it was typed into the console."""
+        words = string.split()
+        if not words:
+            return
+        try:
+            cmd_class = self.commands.get_command(words[0])
+        except KeyError:
+            self.notify("Command not found: `%s'" % words[0], bad=True)
+            return
+        except ValueError as ex:
+            self.notify(ex, bad=True)
+            return
+        self.ui.tag_input(cmd_class.get_name())
+        cmd = cmd_class(string, quantifier=quantifier)
+        cmd.wildcards = wildcards or []
+        try:
+            cmd.execute()
+        except Exception as ex:  # FIXME: Broad exception
+            self.notify(ex, bad=True)
+
     def destroy(self):
         pass
 
@@ -138,6 +239,16 @@ class App(SignalDispatcher):
         pass
 
 
+def parse_arguments():
+    parser = ArgumentParser(prog='ycp')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='print how long each startup phase took on exit')
+    parser.add_argument('--profile', action='store_true',
+                        help='sample the whole session with the built-in profiler '
+                        'and save the result to CACHEDIR/profiles on exit')
+    return parser.parse_args()
+
+
 def set_locale() -> None:
     try:
         locale.setlocale(locale.LC_ALL, '')
@@ -182,24 +293,47 @@ def restore_saved_tabs(app: object) -> None:
             pass  # FIXME: Add message to screen/logger
 
 
+def load_settings(settings: Settings) -> None:
+    """Apply CONFDIR/rc.conf, parsed once and then cached in CACHEDIR"""
+    path = os.path.join(CONFDIR, 'rc.conf')
+    if not os.path.isfile(path):
+        return
+    try:
+        settings.load_file(path, cachedir=os.path.join(CACHEDIR, 'settings'))
+    except (OSError, ValueError) as ex:
+        sys.stderr.write('Error in {0}:\n{1}\n'.format(path, ex))
+
+
 def main() -> bool:
+    global args
+    args = parse_arguments()
+    startup_report = StartupReport(start=_IMPORT_START) if args.startup_report else None
+    if startup_report:
+        startup_report.mark('imports')
+
     set_locale()
     set_level()
 
     # TODO: Add opportunity to save config
     # TODO: Add opportunity to tagging files
-    # TODO: Add some arguments in cli
 
-    SettingsAware.settings_set(Settings())
+    settings = Settings()
+    SettingsAware.settings_set(settings)
+    if startup_report:
+        startup_report.mark('settings')
 
-    profile = None
     exit_msg = ''
     exit_code = 0
     startup_path_tab_index = 0
     try:
         app = App()
+        app.startup_report = startup_report
         VideoManagerAware.app_set(app)
-        # FIXME: Settings load
+        if startup_report:
+            startup_report.mark('app')
+        load_settings(settings)
+        if startup_report:
+            startup_report.mark('config')
         # if args.list_unused_keys:  # FIXME: Console argument
         # maps = app.ui.keymaps['browser']
         # for key in sorted(SPECIAL_KEYS.values(), key=str):
@@ -226,6 +360,8 @@ def main() -> bool:
         app.initialize()
         app.tabs.tab_move(startup_path_tab_index)
         app.ui.initialize()
+        if startup_report:
+            startup_report.mark('ui')
 
         if int(os.environ[LEVEL]) > 1:
             warning = 'Warning:'
@@ -238,14 +374,10 @@ def main() -> bool:
                 app.notify(' '.join((warning.upper(), nested_warning + '!!')),
                            bad=True)
 
-        if app.args.profile:
-            app.__app = app
-            profile_file = tempfile.gettempdir() + '/ycp_profile'
-            # FIXME: Update reference
-            cProfile.run('ycp.__app.loop()', profile_file)
-            profile = pstats.Stats(profile_file, stream=sys.stderr)
-        else:
-            app.loop()
+        if args.profile:
+            app.profiler = SamplingProfiler(settings.profiler_frequency)
+            app.profiler.start()
+        app.loop()
 
     except Exception:
         ex_traceback = traceback.format_exc()
@@ -277,10 +409,19 @@ def main() -> bool:
             app.ui.destroy()
         except (AttributeError, NameError):
             pass
-        # If profiler is enabled print the stats
-        # if app.args.profile and profile:  # FIXME: arguments from console
-            # profile.strip_dirs().sort_stats('cumulative').print_callees()
+        # If the profiler is still running, save what it sampled
+        try:
+            profiler = app.profiler
+        except NameError:
+            profiler = None
+        if profiler is not None and profiler.running:
+            profiler.stop()
+            path = profiler.save(os.path.join(CACHEDIR, 'profiles'),
+                                 settings.profiler_format)
+            sys.stderr.write('Profile saved to {0}\n'.format(path))
         # print the exit message if any
         if exit_msg:
             sys.stderr.write(exit_msg)
+        if startup_report:
+            sys.stderr.write(startup_report.format() + '\n')
         return exit_code
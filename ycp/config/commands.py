@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""The commands that are available in the console by default"""
+
+import os
+import re
+
+from ..services.commands import Command
+from ..misc.sampling_profiler import SamplingProfiler
+
+
+class profile(Command):
+    """:profile [start|stop|toggle]
+
+    Sample the call stacks of ycp with a low-overhead profiler.  The rate
+    is the setting "profiler_frequency" (samples per second) and stopping
+    writes a file in the format of "profiler_format" to CACHEDIR/profiles.
+    Without an argument, the profiler is toggled.
+    """
+
+    def execute(self):
+        action = self.arg(1) or 'toggle'
+        profiler = self.app.profiler
+        running = profiler is not None and profiler.running
+        if action == 'toggle':
+            action = 'stop' if running else 'start'
+
+        if action == 'start':
+            if running:
+                self.app.notify("The profiler is already running")
+                return
+            self.app.profiler = SamplingProfiler(self.settings.profiler_frequency)
+            self.app.profiler.start()
+            self.app.notify("Profiling at %d Hz, use :profile stop to save"
+                            % self.app.profiler.frequency)
+        elif action == 'stop':
+            if not running:
+                self.app.notify("The profiler is not running", bad=True)
+                return
+            profiler.stop()
+            from .. import CACHEDIR
+            path = profiler.save(os.path.join(CACHEDIR, 'profiles'),
+                                 self.settings.profiler_format)
+            self.app.notify("Saved profile to " + path)
+        else:
+            self.app.notify("Usage: profile [start|stop|toggle]", bad=True)
+
+    def tab(self, tabnum):
+        return ['profile ' + action for action in ('start', 'stop', 'toggle')
+                if action.startswith(self.arg(1))]
+
+
+class latency(Command):
+    """:latency [show|reset|export <path>]
+
+    Show the time from a key press until its result is on the screen, as
+    p50/p95/p99 per command.  Key presses that did not run a command are
+    counted as <key>.  "export" writes the table to a file.
+    """
+
+    def execute(self):
+        action = self.arg(1) or 'show'
+        recorder = self.app.ui.input_latency
+        if action == 'show':
+            pager = self.app.ui.open_pager()
+            pager.set_source(recorder.format())
+        elif action == 'reset':
+            recorder.clear()
+            self.app.notify("Cleared the latency histograms")
+        elif action == 'export':
+            path = self.rest(2)
+            if not path:
+                self.app.notify("Usage: latency export <path>", bad=True)
+                return
+            path = os.path.expanduser(path)
+            with open(path, 'w', encoding='utf-8') as fobj:
+                fobj.write(recorder.format() + '\n')
+            self.app.notify("Wrote latency histograms to " + path)
+        else:
+            self.app.notify("Usage: latency [show|reset|export <path>]", bad=True)
+
+    def tab(self, tabnum):
+        return ['latency ' + action for action in ('show', 'reset', 'export')
+                if action.startswith(self.arg(1))]
+
+
+class pager_search(Command):
+    """:pager_search <pattern>
+
+    Search the text in the pager for a regular expression and scroll to
+    the first match.  The search runs in the background and the matches
+    are highlighted.  Lower case patterns ignore the case.
+    """
+
+    def execute(self):
+        pager = self.app.ui.active_pager()
+        pattern = self.rest(1)
+        if pager is None:
+            self.app.notify("No pager is open", bad=True)
+        elif not pattern:
+            self.app.notify("Usage: pager_search <pattern>", bad=True)
+        else:
+            try:
+                pager.search(pattern)
+            except re.error as ex:
+                self.app.notify("Invalid pattern", bad=True, exception=ex)
+
+
+class pager_search_next(Command):
+    """:pager_search_next [-r]
+
+    Scroll the pager to the next match of the last pager_search, or with
+    -r to the previous one.  A quantifier skips that many matches.
+    """
+
+    coalesce = True
+
+    def execute(self):
+        pager = self.app.ui.active_pager()
+        if pager is None or pager.line_search is None:
+            self.app.notify("No search in the pager", bad=True)
+            return
+        forward = self.arg(1) != '-r'
+        if not pager.search_next(forward, self.quantifier or 1):
+            self.app.notify("No more matches", bad=True)
@@ -2,11 +2,12 @@
 """Default options and configurations"""
 
 import re
-import os.path
+import os
+import json
+from hashlib import sha1
 from inspect import isfunction
 
-from ..services.signals import SignalDispatcher
-from ..gui.colorscheme import colorscheme_name_to_class
+from ..services.signals import Signal, SignalDispatcher
 from ..services.shared import VideoManagerAware
 
 # Use these priority constants to trigger events at specific points in time
@@ -41,6 +42,7 @@ ALLOWED_SETTINGS = {
     'draw_progress_bar_in_status_bar': bool,
     'filter_dead_tabs_on_startup': bool,
     'flushinput': bool,
+    'frame_stats': bool,
     # 'freeze_files': bool,
     # 'global_inode_type_filter': str,
     # 'hidden_filter': str,
@@ -52,6 +54,7 @@ ALLOWED_SETTINGS = {
     # 'iterm2_font_height': int,
     'line_numbers': str,
     'max_console_history_size': (int, type(None)),
+    'max_fps': int,
     'max_history_size': (int, type(None)),
     'metadata_deep_search': bool,
     'mouse_enabled': bool,
@@ -65,7 +68,10 @@ ALLOWED_SETTINGS = {
     'preview_images_method': str,
     'preview_max_size': int,
     'preview_script': (str, type(None)),
+    'profiler_format': str,
+    'profiler_frequency': int,
     'relative_current_zero': bool,
+    'row_cache_size': int,
     'save_backtick_bookmark': bool,
     'save_console_history': bool,
     'save_tabs_on_exit': bool,
@@ -113,6 +119,8 @@ ALLOWED_VALUES = {
     'preview_images_method': ['w3m', 'iterm2', 'terminology',
                               'sixel', 'urxvt', 'urxvt-full',
                               'kitty', 'ueberzug'],
+    'profiler_format': ['speedscope', 'collapsed'],
+    'sixel_dithering': ['ordered', 'none'],
     # 'vcs_backend_bzr': ['disabled', 'local', 'enabled'],
     'vcs_backend_git': ['enabled', 'disabled', 'local'],
     # 'vcs_backend_hg': ['disabled', 'local', 'enabled'],
@@ -130,6 +138,8 @@ DEFAULT_VALUES = {
     tuple: tuple([]),
 }
 
+CONFIG_CACHE_SUFFIX = '.json'
+
 
 class Settings(SignalDispatcher, VideoManagerAware):
 
@@ -139,11 +149,9 @@ class Settings(SignalDispatcher, VideoManagerAware):
         self.__dict__['_localregexes'] = {}
         self.__dict__['_tagsettings'] = {}
         self.__dict__['_settings'] = {}
-        for name in ALLOWED_SETTINGS:
-            self.signal_bind('setopt.' + name, self._sanitize,
-                             priority=SIGNAL_PRIORITY_SANITIZE)
-            self.signal_bind('setopt.' + name, self._raw_set_with_signal,
-                             priority=SIGNAL_PRIORITY_SYNC)
+        self.__dict__['_snapshot'] = None
+        self.__dict__['_generation'] = 0
+        self.__dict__['_bound_setopts'] = set()
         for name, values in ALLOWED_VALUES.items():
             assert values
             assert name in ALLOWED_SETTINGS
@@ -162,6 +170,9 @@ class Settings(SignalDispatcher, VideoManagerAware):
                                 for i in value]
 
         elif name == 'colorscheme':
+            # Imported here to keep curses and the colorschemes off the
+            # startup path until a colorscheme is actually set.
+            from ..gui.colorscheme import colorscheme_name_to_class
             colorscheme_name_to_class(signal)
 
         elif name == 'preview_script':
@@ -179,8 +190,19 @@ class Settings(SignalDispatcher, VideoManagerAware):
                 self.app.notify("Preview script undefined or not found!",
                                 bad=True)
 
+    def _bind_setopt(self, name):
+        # The handlers are bound on the first set() of a setting rather
+        # than for every setting in __init__, which keeps startup cheap.
+        self._bound_setopts.add(name)
+        self.signal_bind('setopt.' + name, self._sanitize,
+                         priority=SIGNAL_PRIORITY_SANITIZE)
+        self.signal_bind('setopt.' + name, self._raw_set_with_signal,
+                         priority=SIGNAL_PRIORITY_SYNC)
+
     def set(self, name, value, path=None, tags=None):
         assert name in ALLOWED_SETTINGS, "No such setting: {0}!".format(name)
+        if name not in self._bound_setopts:
+            self._bind_setopt(name)
         if name not in self._settings:
             previous = None
         else:
@@ -199,6 +221,58 @@ class Settings(SignalDispatcher, VideoManagerAware):
         self.signal_emit('setopt', **kws)
         self.signal_emit('setopt.' + name, **kws)
 
+    def load(self, mapping):
+        """Set many settings at once, e.g. from a configuration file.
+
+        All values are validated and sanitized in one pass before any of
+        them is applied, so an invalid entry leaves the settings untouched
+        and raises a ValueError listing every problem.  Once all values
+        are stored, "setopt.<name>" is emitted for each setting that
+        changed, so the usual listeners see the new values, followed by a
+        single "setopt.load" signal with a "changes" dict of {name: value}.
+
+        Returns the dict of settings whose value changed.
+        """
+        errors = []
+        for name, value in mapping.items():
+            if name not in ALLOWED_SETTINGS:
+                errors.append("No such setting: {0}!".format(name))
+            elif not isinstance(value, self.types_of(name)):
+                errors.append("The option `{0}' has an incorrect type! Got {1}, "
+                              "expected {2}!".format(name, type(value),
+                                                     ALLOWED_SETTINGS[name]))
+            elif name in ALLOWED_VALUES and value not in ALLOWED_VALUES[name]:
+                errors.append("The option `{0}' can't be `{1}'!".format(name, value))
+        if errors:
+            raise ValueError('\n'.join(errors))
+
+        changes = {}
+        previous = {}
+        for name, value in mapping.items():
+            signal = Signal(setting=name, value=value,
+                            previous=self._settings.get(name),
+                            path=None, tags=None, app=self.app)
+            self._sanitize(signal)
+            if name not in self._settings or signal.value != signal.previous:
+                changes[name] = signal.value
+                previous[name] = signal.previous
+
+        for name, value in changes.items():
+            self._raw_set(name, value)
+        # The values are stored already, so the sanitize and sync handlers
+        # bound by set() see them unchanged
+        for name, value in changes.items():
+            self.signal_emit('setopt.' + name, setting=name, value=value,
+                             previous=previous[name], path=None, tags=None,
+                             app=self.app)
+        if changes:
+            self.signal_emit('setopt.load', changes=changes, app=self.app)
+        return changes
+
+    def load_file(self, path, cachedir=None):
+        """Load a settings file made of "set <name> <value>" lines."""
+        return self.load(parse_settings_file(path, cachedir))
+
     def _get_default(self, name):
         if name == 'preview_script':
             if ycp.args.clean:  # FIXME: Validate bash file and references om it
@@ -284,35 +358,164 @@ class Settings(SignalDispatcher, VideoManagerAware):
     __getitem__ = __getattr__  # FIXME: private and protected attribute access №2
     __setitem__ = __setattr__
 
+    def _raw_set(self, name, value, path=None, tags=None):
+        self.__dict__['_snapshot'] = None
+        self.__dict__['_generation'] += 1
+        if path:
+            if path not in self._localsettings:
+                try:
+                    regex = re.compile(path)
+                except re.error:  # Bad regular expression
+                    return
+                self._localregexes[path] = regex
+                self._localsettings[path] = {}
+            self._localsettings[path][name] = value
+
+            # make sure name is in _settings, so __iter__ runs through
+            # local settings too.
+            if name not in self._settings:
+                type_ = self.types_of(name)[0]
+                value = DEFAULT_VALUES[type_]
+                self._settings[name] = value
+        elif tags:
+            for tag in tags:
+                if tag not in self._tagsettings:
+                    self._tagsettings[tag] = {}
+                self._tagsettings[tag][name] = value
+        else:
+            self._settings[name] = value
+
+    def _raw_set_with_signal(self, signal):
+        self._raw_set(signal.setting, signal.value, signal.path, signal.tags)
+
+    @property
+    def generation(self):
+        """A counter that grows whenever any setting changes"""
+        return self._generation
 
-def _raw_set(self, name, value, path=None, tags=None):
-    if path:
-        if path not in self._localsettings:
+    def snapshot(self):
+        """Return a read-only SettingsSnapshot of the current values.
+
+        The snapshot is reused until a setting changes or the current
+        directory, which decides the local settings, is a different one.
+        """
+        try:
+            localpath = self.app.thisdir.path
+        except AttributeError:
+            localpath = None
+        snapshot = self._snapshot
+        if snapshot is None or snapshot._localpath != localpath:
+            snapshot = SettingsSnapshot(self, localpath)
+            self.__dict__['_snapshot'] = snapshot
+        return snapshot
+
+
+def _parse_value(name, string):
+    """Convert the string of a "set" line to the type of the setting.
+
+    >>> _parse_value('preview_files', 'true')
+    True
+    >>> _parse_value('scroll_offset', '8')
+    8
+    >>> _parse_value('max_history_size', 'none') is None
+    True
+    >>> _parse_value('column_ratios', '1,3,4')
+    ['1', '3', '4']
+    """
+    types = Settings.types_of(name)
+    lowered = string.lower()
+    if bool in types:
+        if lowered in ('true', 'on', 'yes', '1'):
+            return True
+        if lowered in ('false', 'off', 'no', '0'):
+            return False
+    if type(None) in types and lowered in ('', 'none'):
+        return None
+    for typ in (int, float):
+        if typ in types:
             try:
-                regex = re.compile(path)
-            except re.error:  # Bad regular expression
-                return
-            self._localregexes[path] = regex
-            self._localsettings[path] = {}
-        self._localsettings[path][name] = value
-
-        # make sure name is in _settings, so __iter__ runs through
-        # local settings too.
-        if name not in self._settings:
-            type_ = self.types_of(name)[0]
-            value = DEFAULT_VALUES[type_]
-            self._settings[name] = value
-    elif tags:
-        for tag in tags:
-            if tag not in self._tagsettings:
-                self._tagsettings[tag] = {}
-            self._tagsettings[tag][name] = value
-    else:
-        self._settings[name] = value
+                return typ(string)
+            except ValueError:
+                pass
+    if list in types or tuple in types:
+        return [item.strip() for item in string.split(',')]
+    return string
+
+
+def parse_settings_file(path, cachedir=None):
+    """Parse a settings file into a {name: value} dict.
+
+    If cachedir is given, the result is cached there as JSON and reused as
+    long as the modification time and size of the file are unchanged.
+    """
+    stat = os.stat(path)
+    key = [stat.st_mtime_ns, stat.st_size]
+    if cachedir is None:
+        return _parse_settings_lines(path)
+    abspath = os.path.abspath(path)
+    cachepath = os.path.join(cachedir, '{0}-{1}{2}'.format(
+        os.path.basename(abspath),
+        sha1(abspath.encode('utf-8', 'surrogateescape')).hexdigest()[:12],
+        CONFIG_CACHE_SUFFIX))
+    try:
+        with open(cachepath, 'r', encoding='utf-8') as fobj:
+            cache = json.load(fobj)
+        if cache['key'] == key:
+            return cache['values']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    values = _parse_settings_lines(path)
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        with open(cachepath, 'w', encoding='utf-8') as fobj:
+            json.dump({'key': key, 'values': values}, fobj)
+    except OSError:
+        pass
+    return values
+
+
+def _parse_settings_lines(path):
+    values = {}
+    with open(path, 'r', encoding='utf-8') as fobj:
+        for line in fobj:
+            words = line.strip().split(None, 2)
+            if len(words) < 2 or words[0] != 'set':
+                continue
+            name = words[1]
+            values[name] = _parse_value(name, words[2] if len(words) > 2 else '')
+    return values
+
+
+class SettingsSnapshot:
+    """A frozen copy of the settings, taken once per frame by the UI.
+
+    Every value is a plain instance attribute, so reading it inside a
+    per-row loop skips Settings.get() and its local regex checks.
+    Settings which have never been set fall back to the live object.
+
+    The generation grows with every change of a setting, so it can stand
+    in for all settings (the colorscheme included) in a cache key.
+    """
+
+    def __init__(self, settings, localpath=None):
+        values = self.__dict__
+        values['_settings'] = settings
+        values['_localpath'] = localpath
+        values['generation'] = settings._generation
+        for name in settings:
+            values[name] = settings.get(name, localpath)
 
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._settings.get(name, self._localpath)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The settings snapshot is read-only, "
+                             "use Settings.set() to change `{0}'".format(name))
 
-def _raw_set_with_signal(self, signal):
-    self._raw_set(signal.setting, signal.value, signal.path, signal.tags)
+    __getitem__ = __getattr__
 
 
 class LocalSettings:
@@ -2,11 +2,13 @@
 """A library to help to convert ANSI codes to curses instructions."""
 
 import re
-from ..misc.widestring import WideString
+from ..misc.widestring import WideString, uwid
 from . import color
 
 ansi_re = re.compile('(\x1b' + r'\[\d*(?:;\d+)*?[a-zA-Z])')
-codesplit_re = re.compile(r'38;5;(\d+);|48;5;(\d+);|(\d*);')
+codesplit_re = re.compile(r'38;5;(\d+);|48;5;(\d+);'
+                          r'|38;2;(\d+);(\d+);(\d+);|48;2;(\d+);(\d+);(\d+);'
+                          r'|(\d*);')
 RESET = '\x1b[0m'
 
 
@@ -14,85 +16,184 @@ def split_ansi_from_text(ansi_text):
     return ansi_re.split(ansi_text)
 
 
+def _apply_codes(attr_args, fg, bg, attr):
+    """Return fg, bg and attr changed by the arguments of an SGR sequence
+
+    >>> _apply_codes('1;38;2;255;0;0', -1, -1, 0)[0] in (196, 9, 1)
+    True
+    """
+    for (x256fg, x256bg, red, green, blue,
+         bg_red, bg_green, bg_blue, arg) in codesplit_re.findall(attr_args + ';'):
+        # first handle xterm256 and 24-bit codes
+        try:
+            if x256fg:  # xterm256 foreground
+                fg = int(x256fg)
+                continue
+            elif x256bg:  # xterm256 background
+                bg = int(x256bg)
+                continue
+            elif red:  # 24-bit foreground
+                fg = color.rgb_to_color(min(255, int(red)), min(255, int(green)),
+                                        min(255, int(blue)))
+                continue
+            elif bg_red:  # 24-bit background
+                bg = color.rgb_to_color(min(255, int(bg_red)), min(255, int(bg_green)),
+                                        min(255, int(bg_blue)))
+                continue
+            elif arg:  # usual ansi code
+                n = int(arg)
+            else:  # empty code means reset
+                n = 0
+        except ValueError:
+            continue
+
+        if n == 0:  # reset colors and attributes
+            fg, bg, attr = -1, -1, 0
+
+        elif n == 1:  # enable attribute
+            attr |= color.BOLD
+        elif n == 4:
+            attr |= color.UNDERLINE
+        elif n == 5:
+            attr |= color.BLINK
+        elif n == 7:
+            attr |= color.REVERSE
+        elif n == 8:
+            attr |= color.INVISIBLE
+
+        elif n == 22:  # disable attribute
+            attr &= ~color.BOLD
+        elif n == 24:
+            attr &= ~color.UNDERLINE
+        elif n == 25:
+            attr &= ~color.BLINK
+        elif n == 27:
+            attr &= ~color.REVERSE
+        elif n == 28:
+            attr &= ~color.INVISIBLE
+
+        elif 30 <= n <= 37:  # 8 ansi foreground and background colors
+            fg = n - 30
+        elif n == 39:
+            fg = -1
+        elif 40 <= n <= 47:
+            bg = n - 40
+        elif n == 49:
+            bg = -1
+
+        # 8 aixterm high intensity colors (light but not bold)
+        elif 90 <= n <= 97:
+            fg = n - 90 + 8
+        elif n == 99:
+            fg = -1
+        elif 100 <= n <= 107:
+            bg = n - 100 + 8
+        elif n == 109:
+            bg = -1
+    return fg, bg, attr
+
+
 def text_with_fg_bg_attr(ansi_text):
     fg, bg, attr = -1, -1, 0
     for chunk in split_ansi_from_text(ansi_text):
         if chunk and chunk[0] == '\x1b':
             if chunk[-1] != 'm':
                 continue
-            match = re.match(r'^.\[(.*).$', chunk)
-            if not match:
-                # XXX I have no test case to determine what should happen here
-                continue
-            attr_args = match.group(1)
-
-            # Convert arguments to attributes/colors
-            for x256fg, x256bg, arg in codesplit_re.findall(attr_args + ';'):
-                # first handle xterm256 codes
-                try:
-                    if x256fg:  # xterm256 foreground
-                        fg = int(x256fg)
-                        continue
-                    elif x256bg:  # xterm256 background
-                        bg = int(x256bg)
-                        continue
-                    elif arg:  # usual ansi code
-                        n = int(arg)
-                    else:  # empty code means reset
-                        n = 0
-                except ValueError:
-                    continue
-
-                if n == 0:  # reset colors and attributes
-                    fg, bg, attr = -1, -1, 0
-
-                elif n == 1:  # enable attribute
-                    attr |= color.bold
-                elif n == 4:
-                    attr |= color.underline
-                elif n == 5:
-                    attr |= color.blink
-                elif n == 7:
-                    attr |= color.reverse
-                elif n == 8:
-                    attr |= color.invisible
-
-                elif n == 22:  # disable attribute
-                    attr &= not color.bold
-                elif n == 24:
-                    attr &= not color.underline
-                elif n == 25:
-                    attr &= not color.blink
-                elif n == 27:
-                    attr &= not color.reverse
-                elif n == 28:
-                    attr &= not color.invisible
-
-                elif 30 <= n <= 37:  # 8 ansi foreground and background colors
-                    fg = n - 30
-                elif n == 39:
-                    fg = -1
-                elif 40 <= n <= 47:
-                    bg = n - 40
-                elif n == 49:
-                    bg = -1
-
-                # 8 aixterm high intensity colors (light but not bold)
-                elif 90 <= n <= 97:
-                    fg = n - 90 + 8
-                elif n == 99:
-                    fg = -1
-                elif 100 <= n <= 107:
-                    bg = n - 100 + 8
-                elif n == 109:
-                    bg = -1
-
+            # ansi_re guarantees the chunk to start with "\x1b["
+            fg, bg, attr = _apply_codes(chunk[2:-1], fg, bg, attr)
             yield fg, bg, attr
 
         else:
             yield chunk
 
 
+def tokenize(ansi_text):
+    """Split a line into runs of text with the same colors.
+
+    Returns a list of (text, fg, bg, attr, width) tuples, where width is
+    the number of terminal cells the text takes.
+
+    >>> tokenize("ab\x1b[31mモ\x1b[0m ")
+    [('ab', -1, -1, 0, 2), ('モ', 1, -1, 0, 2), (' ', -1, -1, 0, 1)]
+    """
+    segments = []
+    fg, bg, attr = -1, -1, 0
+    for chunk in split_ansi_from_text(ansi_text):
+        if not chunk:
+            continue
+        if chunk[0] == '\x1b':
+            if chunk[-1] == 'm':
+                fg, bg, attr = _apply_codes(chunk[2:-1], fg, bg, attr)
+        else:
+            segments.append((chunk, fg, bg, attr, uwid(chunk)))
+    return segments
+
+
+def slice_segments(segments, start, length):
+    """Return the part of the segments from cell start to start + length.
+
+    A segment is a tuple whose first item is its text and whose last item
+    is its width, like the ones made by tokenize().  Segments that are
+    cut get a new text and width; wide chars cut in half become spaces.
+
+    >>> slice_segments([('abc', 0, 3), ('モヒ', 1, 4)], 2, 4)
+    [('c', 0, 1), ('モ ', 1, 3)]
+    >>> slice_segments([('abc', 0, 3)], 5, 4)
+    []
+    """
+    result = []
+    stop = start + length
+    pos = 0
+    for segment in segments:
+        end = pos + segment[-1]
+        if end > start:
+            if pos >= stop:
+                break
+            if pos >= start and end <= stop:
+                result.append(segment)
+            else:
+                text = str(WideString(segment[0])[max(0, start - pos):stop - pos])
+                result.append((text,) + segment[1:-1] + (uwid(text),))
+        pos = end
+    return result
+
+
+def highlight_segments(segments, spans, attr):
+    """Return tokenize() segments with attr added inside spans.
+
+    The spans are (start, end) character offsets into the text of all
+    segments put together.
+
+    >>> highlight_segments([('abc', 1, -1, 0, 3), ('de', 2, -1, 1, 2)], [(2, 4)], 8)
+    ... # doctest: +NORMALIZE_WHITESPACE
+    [('ab', 1, -1, 0, 2), ('c', 1, -1, 8, 1), ('d', 2, -1, 9, 1),
+     ('e', 2, -1, 1, 1)]
+    """
+    result = []
+    pos = 0
+    for segment in segments:
+        text, fg, bg, seg_attr, _ = segment
+        end = pos + len(text)
+        cuts = {0, len(text)}
+        for start, stop in spans:
+            if start < end and stop > pos:
+                cuts.add(max(0, start - pos))
+                cuts.add(min(len(text), stop - pos))
+        if len(cuts) == 2 and not any(start <= pos and end <= stop
+                                      for start, stop in spans):
+            result.append(segment)
+        else:
+            cuts = sorted(cuts)
+            for left, right in zip(cuts, cuts[1:]):
+                piece = text[left:right]
+                hit = any(start <= pos + left and pos + right <= stop
+                          for start, stop in spans)
+                result.append((piece, fg, bg, seg_attr | attr if hit else seg_attr,
+                               uwid(piece)))
+        pos = end
+    return result
+
+
 def char_len(ansi_text):
     """Count the number of visible characters.
 
@@ -107,7 +208,7 @@ def char_len(ansi_text):
     >>> char_len("")
     0
     """
-    return len(WideString(ansi_re.sub('', ansi_text)))
+    return uwid(ansi_re.sub('', ansi_text))
 
 
 def char_slice(ansi_text, start, length):
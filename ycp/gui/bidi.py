@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""Lazy, cached access to the python-bidi package.
+
+Only texts that contain right-to-left characters are reordered.  The
+others are returned at once, without importing bidi at all, so the LTR
+titles that make up most of a library cost a regex search.  Reordered
+texts are memoized.  If the package is missing, texts are returned
+unchanged.
+"""
+
+import re
+from functools import lru_cache
+
+REORDER_CACHE_SIZE = 1024
+
+# Hebrew, Arabic, Syriac, Thaana, NKo, Samaritan, Mandaic and their
+# supplements and presentation forms, the RTL marks and embeddings, and
+# the RTL blocks outside the BMP.
+RTL_RE = re.compile(
+    '[\u0590-\u08ff\ufb1d-\ufdff\ufe70-\ufeff'
+    '\u200f\u202b\u202e\u2067'
+    '\U00010800-\U00010fff\U0001e800-\U0001efff]')
+
+_GET_DISPLAY = None
+
+
+def _load():
+    global _GET_DISPLAY
+    try:
+        from bidi.algorithm import get_display as _get_display
+    except ImportError:
+        _get_display = None
+    _GET_DISPLAY = _get_display or str
+    return _GET_DISPLAY
+
+
+def have_bidi():
+    """Return whether the bidi package is available."""
+    return (_GET_DISPLAY or _load()) is not str
+
+
+def has_rtl(text):
+    """Return whether text contains right-to-left characters
+
+    >>> has_rtl('Lecture 01.mp4'), has_rtl('Ünïcödé'), has_rtl('שלום.mp4')
+    (False, False, True)
+    """
+    return not text.isascii() and RTL_RE.search(text) is not None
+
+
+@lru_cache(maxsize=REORDER_CACHE_SIZE)
+def _reorder(text):
+    return (_GET_DISPLAY or _load())(text)
+
+
+def get_display(text):
+    """Return text reordered for display, as bidi.algorithm.get_display."""
+    if not has_rtl(text):
+        return text
+    return _reorder(text)
@@ -13,46 +13,151 @@ bool(attr & reverse) # => False
 """
 
 import curses
+from collections import OrderedDict
+from functools import lru_cache
 
 DEFAULT_FOREGROUND = curses.COLOR_WHITE
 DEFAULT_BACKGROUND = curses.COLOR_BLACK
 # Color pair 0 is wired to white on black and cannot be changed
 COLOR_PAIRS = {(DEFAULT_FOREGROUND, DEFAULT_BACKGROUND): 0}
+# Pairs of preview text, least recently used first.  When the terminal
+# runs out of pairs, these are redefined; the ones in COLOR_PAIRS, which
+# colorschemes have cached, never are.  Recycling is best effort: a pair
+# handed out in the current frame is kept, but text from earlier frames
+# that was not drawn again changes color if its pair is taken.
+PREVIEW_PAIRS = OrderedDict()
+# Preview pairs handed out since begin_frame()
+_FRAME_PAIRS = set()
+_NEXT_PAIR = 1
+
+# The levels of the 6x6x6 color cube of 256 color terminals
+CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+# The nearest cube level and gray (232 + n, 8 + 10 * n) of a channel value
+CUBE_INDEX = bytes(min(range(6), key=lambda i: abs(CUBE_LEVELS[i] - value))
+                   for value in range(256))
+GRAY_INDEX = bytes(min(23, max(0, (value - 3) // 10)) for value in range(256))
+# xterm's default values of the 16 basic colors
+BASIC_COLORS = (
+    (0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0),
+    (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229),
+    (127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+    (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255),
+)
+QUANTIZE_CACHE_SIZE = 4096
+
+
+def _init_pair(number, fg, bg):
+    """Define a pair; raises ValueError if number is past the last pair"""
+    try:
+        curses.init_pair(number, fg, bg)
+    except curses.error:
+        # If curses.use_default_colors() failed during the initialization
+        # of curses, then using -1 as fg or bg will fail as well, which
+        # we need to handle with fallback-defaults:
+        if fg == -1:  # -1 is the "default" color
+            fg = DEFAULT_FOREGROUND
+        if bg == -1:  # -1 is the "default" color
+            bg = DEFAULT_BACKGROUND
+
+        try:
+            curses.init_pair(number, fg, bg)
+        except curses.error:
+            # If this fails too, colors are probably not supported
+            pass
+
+
+def _allocate_pair(fg, bg):
+    global _NEXT_PAIR
+    try:
+        _init_pair(_NEXT_PAIR, fg, bg)
+    except ValueError:
+        # We're trying to add more pairs than the terminal can store.
+        # Take the preview pair that was used the longest time ago, or
+        # fall back to the default fore and background colors, pair 0.
+        # The pairs of this frame are the most recent, so if the oldest
+        # one is among them, all of them are.
+        if not PREVIEW_PAIRS or next(iter(PREVIEW_PAIRS.values())) in _FRAME_PAIRS:
+            return 0
+        _, number = PREVIEW_PAIRS.popitem(last=False)
+        _init_pair(number, fg, bg)
+        return number
+    _NEXT_PAIR += 1
+    return _NEXT_PAIR - 1
 
 
 def get_color(fg, bg):
-    """Returns the curses color pair for the given fg/bg combination."""
+    """Returns the curses color pair for the given fg/bg combination.
+
+    The pair is never redefined, so it can be cached.
+    """
 
     key = (fg, bg)
-    if key not in COLOR_PAIRS:
-        size = len(COLOR_PAIRS)
-        try:
-            curses.init_pair(size, fg, bg)
-        except ValueError:
-            # We're trying to add more pairs than the terminal can store,
-            # approximating to the closest color pair that's already stored
-            # would be cool but the easier solution is to just fall back to the
-            # default fore and background colors, pair 0
-            COLOR_PAIRS[key] = 0
-        except curses.error:
-            # If curses.use_default_colors() failed during the initialization
-            # of curses, then using -1 as fg or bg will fail as well, which
-            # we need to handle with fallback-defaults:
-            if fg == -1:  # -1 is the "default" color
-                fg = DEFAULT_FOREGROUND
-            if bg == -1:  # -1 is the "default" color
-                bg = DEFAULT_BACKGROUND
-
-            try:
-                curses.init_pair(size, fg, bg)
-            except curses.error:
-                # If this fails too, colors are probably not supported
-                pass
-            COLOR_PAIRS[key] = size
-        else:
-            COLOR_PAIRS[key] = size
-
-    return COLOR_PAIRS[key]
+    try:
+        return COLOR_PAIRS[key]
+    except KeyError:
+        pass
+    number = PREVIEW_PAIRS.pop(key, None)
+    if number is None:
+        number = _allocate_pair(fg, bg)
+    COLOR_PAIRS[key] = number
+    return number
+
+
+def get_preview_color(fg, bg):
+    """Returns a color pair for fg/bg that may be redefined later.
+
+    For the many colors of previews.  Look it up again every time it is
+    drawn; pairs used in the current frame are not recycled, and recently
+    used ones are recycled last.
+    """
+    key = (fg, bg)
+    number = COLOR_PAIRS.get(key)
+    if number is not None:
+        return number
+    try:
+        PREVIEW_PAIRS.move_to_end(key)
+        number = PREVIEW_PAIRS[key]
+    except KeyError:
+        number = _allocate_pair(fg, bg)
+        if not number:
+            return number
+        PREVIEW_PAIRS[key] = number
+    _FRAME_PAIRS.add(number)
+    return number
+
+
+def begin_frame():
+    """Let the preview pairs of the last frame be recycled again"""
+    _FRAME_PAIRS.clear()
+
+
+def rgb_to_color(red, green, blue):
+    """Returns the nearest color the terminal has to a 24-bit color"""
+    return quantize_rgb(red, green, blue, getattr(curses, 'COLORS', 8))
+
+
+@lru_cache(maxsize=QUANTIZE_CACHE_SIZE)
+def quantize_rgb(red, green, blue, colors):
+    """Returns the nearest of the first colors (8, 16 or 256) to an RGB color
+
+    >>> quantize_rgb(255, 0, 0, 256), quantize_rgb(128, 128, 128, 256)
+    (196, 244)
+    >>> quantize_rgb(255, 10, 0, 16), quantize_rgb(200, 10, 0, 8)
+    (9, 1)
+    """
+    if colors >= 256:
+        cube = CUBE_INDEX[red], CUBE_INDEX[green], CUBE_INDEX[blue]
+        gray = GRAY_INDEX[(red + green + blue) // 3]
+        gray_value = 8 + 10 * gray
+        cube_distance = sum((CUBE_LEVELS[level] - value) ** 2
+                            for level, value in zip(cube, (red, green, blue)))
+        gray_distance = sum((gray_value - value) ** 2 for value in (red, green, blue))
+        if gray_distance < cube_distance:
+            return 232 + gray
+        return 16 + 36 * cube[0] + 6 * cube[1] + cube[2]
+    basic = BASIC_COLORS[:16 if colors >= 16 else 8]
+    return min(range(len(basic)), key=lambda i: sum(
+        (a - b) ** 2 for a, b in zip(basic[i], (red, green, blue))))
 
 
 BLACK = curses.COLOR_BLACK
@@ -75,6 +180,17 @@ DIM = curses.A_DIM
 
 default_colors = (DEFAULT, DEFAULT, NORMAL)
 
-curses.setupterm()
 
-BRIGHT = 8 if curses.tigetnum('colors') >= 16 else 0
+def __getattr__(name):
+    # BRIGHT needs the terminfo database.  Look it up on first use rather
+    # than at import time; by then initscr() has usually loaded it already.
+    if name == 'BRIGHT':
+        global BRIGHT
+        try:
+            colors = curses.tigetnum('colors')
+        except curses.error:
+            curses.setupterm()
+            colors = curses.tigetnum('colors')
+        BRIGHT = 8 if colors >= 16 else 0
+        return BRIGHT
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
@@ -28,12 +28,11 @@ import os.path
 from abc import abstractmethod
 from curses import color_pair
 from io import open
-from functools import cache
 
 # from .. import YCPDIR, CONFDIR
 from .color import get_color
-from .context import Context
-from ..misc.utils import allow_access_to_confdir, flatten
+from .context import Context, context_mask
+from ..misc.utils import allow_access_to_confdir
 
 
 class ColorSchemeError(Exception):
@@ -45,30 +44,53 @@ class ColorScheme:
 
     it defines the get() method, which returns the color tuple
     which fits to the given keys.
+
+    Colors are cached per scheme in dicts keyed by the int mask of the
+    keys (see context.context_mask), so a lookup is one mask and one dict
+    get.  The tables go away with the scheme when it is replaced.
     """
 
-    @cache
+    def __init__(self):
+        self._colors = {}
+        self._attrs = {}
+
     def get(self, *keys):
         """Returns the (fg, bg, attr) for the given keys.
 
         Using this function rather than use() will cache all
         colors for faster access.
         """
-        context = Context(keys)
-        color = self.use(context)
+        return self.get_for_mask(context_mask(keys))
+
+    def get_for_mask(self, mask):
+        try:
+            return self._colors[mask]
+        except KeyError:
+            pass
+        color = self.use(Context.from_mask(mask))
         if len(color) != 3 or not all(isinstance(value, int) for value in color):
             raise ValueError("Bad Value from colorscheme.  Need "
                              "a tuple of (foreground_color, background_color, attribute).")
+        self._colors[mask] = color
         return color
 
-    @cache
     def get_attr(self, *keys):
         """Returns the curses attribute for the specified keys
 
         Ready to use for curses.setattr()
         """
-        fg, bg, attr = self.get(*flatten(keys))
-        return attr | color_pair(get_color(fg, bg))
+        return self.get_attr_for_mask(context_mask(keys))
+
+    def get_attr_for_mask(self, mask):
+        """Returns the curses attribute for the keys in mask"""
+        try:
+            return self._attrs[mask]
+        except KeyError:
+            pass
+        fg, bg, attr = self.get_for_mask(mask)
+        attr |= color_pair(get_color(fg, bg))
+        self._attrs[mask] = attr
+        return attr
 
     @abstractmethod
     def use(self, context):
@@ -1,5 +1,15 @@
 # -*- coding: utf-8 -*-
 
+"""The context passed to ColorScheme.use().
+
+A context is a set of keys.  Each key has a bit, so a set of keys can be
+stored as an int mask, which is what colorschemes cache their colors by.
+Keys that are not in CONTEXT_KEYS, e.g. from plugins, get the next free
+bit the first time they are seen.
+"""
+
+from collections import deque
+
 
 CONTEXT_KEYS = [
     'reset', 'error', 'badinfo',
@@ -26,6 +36,10 @@ CONTEXT_KEYS = [
 ]
 
 
+CONTEXT_BITS = {}
+KEY_OF_BIT = {}
+
+
 class Context:  # FIXME: Reduce public methods
 
     def __init__(self, keys):
@@ -34,11 +48,56 @@ class Context:  # FIXME: Reduce public methods
         for key in keys:
             dictionary[key] = True
 
+    @classmethod
+    def from_mask(cls, mask):
+        """Return the context of the keys whose bits are set in mask
+
+        >>> context = Context.from_mask(context_mask(['in_browser', 'file']))
+        >>> context.in_browser, context.file, context.directory
+        (True, True, False)
+        """
+        keys = []
+        while mask:
+            bit = mask & -mask
+            keys.append(KEY_OF_BIT[bit])
+            mask ^= bit
+        return cls(keys)
+
+
+def _add_key(key):
+    bit = 1 << len(KEY_OF_BIT)
+    CONTEXT_BITS[key] = bit
+    KEY_OF_BIT[bit] = key
+    setattr(Context, key, False)
+    return bit
+
+
+def context_mask(keys):
+    """Return the int mask of keys, which may be nested in lists and tuples
+
+    >>> context_mask(['reset']), context_mask(['error', ('badinfo',), ['error']])
+    (1, 6)
+    >>> context_mask(['some_plugin_key']) == CONTEXT_BITS['some_plugin_key']
+    True
+    """
+    mask = 0
+    for key in keys:
+        try:
+            bit = CONTEXT_BITS[key]
+        except (KeyError, TypeError):
+            if isinstance(key, (tuple, list, set, deque)):
+                bit = context_mask(key)
+            else:
+                bit = _add_key(key)
+        mask |= bit
+    return mask
+
 
 def _context_init():
     # set all keys to False
     for key in CONTEXT_KEYS:
-        setattr(Context, key, False)
+        if key not in CONTEXT_BITS:
+            _add_key(key)
 
 
 _context_init()
@@ -4,7 +4,7 @@
 import sys
 import curses
 
-from .color import get_color
+from .color import get_preview_color
 from ..services.shared import SettingsAware
 
 REVERSE_ADDCH_ARGS = sys.version[0:5] == '3.7.0'
@@ -83,7 +83,7 @@ class CursesShortcuts(SettingsAware):
 
     def set_fg_bg_attr(self, fg, bg, attr):
         try:
-            self.win.attrset(curses.color_pair(get_color(fg, bg)) | attr)
+            self.win.attrset(curses.color_pair(get_preview_color(fg, bg)) | attr)
         except curses.error:
             pass
 
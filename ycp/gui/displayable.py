@@ -1,19 +1,14 @@
 # -*- coding: utf-8 -*-
 """Bunch of abstract classes for widget manipulating"""
 import curses
+from time import perf_counter
 
 
+from . import bidi
 from .curses_shortcuts import CursesShortcuts
 # from .ui import UI
 from ..services.shared import VideoManagerAware
 
-try:
-    from bidi.algorithm import get_display
-    HAVE_BIDI = True
-except ImportError:
-    from bidi.algorithm import get_display
-    HAVE_BIDI = False
-
 
 class Displayable(VideoManagerAware, CursesShortcuts):  # FIXME: disable=too-many-instance-attributes
     """Displayables are objects which are displayed on the screen.
@@ -48,6 +43,7 @@ class Displayable(VideoManagerAware, CursesShortcuts):  # FIXME: disable=too-man
         parent -- the parent (DisplayableContainer) object or None
         x, y, wid, hei -- absolute coordinates and boundaries
         settings, app -- inherited shared variables
+        frame_settings -- read-only settings snapshot of the current frame
     """
 
     def __init__(self,
@@ -212,9 +208,20 @@ class Displayable(VideoManagerAware, CursesShortcuts):  # FIXME: disable=too-man
     def __str__(self):
         return self.__class__.__name__
 
+    @property
+    def frame_settings(self):
+        """The settings snapshot of the frame that is being drawn.
+
+        Prefer this over self.settings in code that runs once per row.
+        """
+        snapshot = self.app.ui.settings_snapshot
+        if snapshot is None:
+            return self.settings
+        return snapshot
+
     def bidi_transpose(self, text):
-        if self.settings.bidi_support and HAVE_BIDI:
-            return get_display(text)
+        if self.frame_settings.bidi_support:
+            return bidi.get_display(text)
         return text
 
 
@@ -251,24 +258,42 @@ class DisplayableContainer(Displayable, CursesShortcuts):
     def poke(self):
         """Recursively called on objects in container"""
         Displayable.poke(self)
+        stats = self.app.ui.frame_stats
         for displayable in self.container:
-            displayable.poke()
+            if stats is None:
+                displayable.poke()
+            else:
+                start = perf_counter()
+                displayable.poke()
+                stats.record(displayable, 'poke', perf_counter() - start)
 
     def draw(self):
         """Recursively called on visible objects in container"""
+        stats = self.app.ui.frame_stats
         for displayable in self.container:
             if self.need_redraw:
                 displayable.need_redraw = True
             if displayable.visible:
-                displayable.draw()
+                if stats is None:
+                    displayable.draw()
+                else:
+                    start = perf_counter()
+                    displayable.draw()
+                    stats.record(displayable, 'draw', perf_counter() - start)
 
         self.need_redraw = False
 
     def finalize(self):
         """Recursively called on visible objects in container"""
+        stats = self.app.ui.frame_stats
         for displayable in self.container:
             if displayable.visible:
-                displayable.finalize()
+                if stats is None:
+                    displayable.finalize()
+                else:
+                    start = perf_counter()
+                    displayable.finalize()
+                    stats.record(displayable, 'finalize', perf_counter() - start)
 
     def press(self, key):
         """Recursively called on objects in container"""
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""Decide when the main loop draws a frame.
+
+Widgets and background workers ask for a frame with request() instead of
+drawing themselves.  Requests that come in between two frames are served
+by one frame.  Frames for input are drawn at once.  Frames that only
+show background progress (downloads, a stream being read, search
+results) are drawn at most max_fps times a second.
+"""
+
+from time import monotonic
+
+from ..services.shared import SettingsAware
+
+DEFAULT_MAX_FPS = 30
+
+
+class FrameScheduler(SettingsAware):
+    """Coalesces redraw requests and caps the rate of background frames
+
+    >>> now = [0.0]
+    >>> scheduler = FrameScheduler(clock=lambda: now[0], max_fps=20)
+    >>> scheduler.begin_frame(); scheduler.frame_rendered()
+    >>> now[0] = 0.01
+    >>> scheduler.request()
+    >>> scheduler.frame_due(), round(scheduler.timeout(), 3)
+    (False, 0.04)
+    >>> now[0] = 0.05
+    >>> scheduler.frame_due()
+    True
+    >>> scheduler.begin_frame(); scheduler.frame_rendered()
+    >>> now[0] = 0.06
+    >>> scheduler.request(); scheduler.request(immediate=True)
+    >>> scheduler.frame_due(), scheduler.timeout()
+    (True, 0)
+    >>> scheduler.begin_frame()
+    >>> scheduler.request()  # a worker, while the frame is drawn
+    >>> scheduler.frame_rendered()
+    >>> scheduler.frame_due(), round(scheduler.timeout(), 3)
+    (False, 0.05)
+    """
+
+    def __init__(self, wakeup=None, clock=monotonic, max_fps=None):
+        self.wakeup = wakeup
+        self.clock = clock
+        self._max_fps = max_fps
+        self._requested = False
+        self._immediate = False
+        self._last_frame = None
+
+    @property
+    def max_fps(self):
+        return max(1, self._max_fps or self.settings.max_fps or DEFAULT_MAX_FPS)
+
+    def request(self, immediate=False):
+        """Ask for a frame.  Safe to call from any thread.
+
+        Immediate frames, for input, are drawn on the next round of the
+        main loop; others wait for their turn.
+        """
+        if immediate:
+            self._immediate = True
+        elif self._requested:
+            return
+        self._requested = True
+        if self.wakeup is not None:
+            self.wakeup()  # so the main loop sets its timeout
+
+    def _next_frame(self):
+        if self._last_frame is None:
+            return None
+        return self._last_frame + 1.0 / self.max_fps
+
+    def frame_due(self):
+        if self._immediate:
+            return True
+        if not self._requested:
+            return False
+        next_frame = self._next_frame()
+        return next_frame is None or self.clock() >= next_frame
+
+    def timeout(self):
+        """How long the main loop may sleep before the next frame is due"""
+        if self._immediate:
+            return 0
+        if not self._requested:
+            return None
+        next_frame = self._next_frame()
+        if next_frame is None:
+            return 0
+        return max(0, next_frame - self.clock())
+
+    def begin_frame(self):
+        """Call right before drawing.
+
+        Requests made while the frame is drawn are kept for the next one,
+        as the frame may have missed what they announce.
+        """
+        self._requested = self._immediate = False
+
+    def frame_rendered(self):
+        self._last_frame = self.clock()
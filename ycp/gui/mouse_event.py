@@ -34,6 +34,8 @@ class MouseEvent(object):
     def __init__(self, getmouse):
         """Creates a MouseEvent object from the result of win.getmouse()"""
         _, self.x, self.y, _, self.bstate = getmouse
+        # How many identical wheel events were merged into this one
+        self.repeat = 1
 
         # x-values above ~220 suddenly became negative, apparently
         # it's sufficient to add 0xFF to fix that error.
@@ -58,13 +60,17 @@ class MouseEvent(object):
         # Recently it seems to have been fixed, as 2**21 was introduced as
         # the code for the "scroll down" button.
         if self.bstate & curses.BUTTON4_PRESSED:
-            return -self.CTRL_SCROLLWHEEL_MULTIPLIER if self.ctrl() else -1
+            return -self.repeat * (self.CTRL_SCROLLWHEEL_MULTIPLIER if self.ctrl() else 1)
         elif self.bstate & curses.BUTTON2_PRESSED \
                 or self.bstate & 2 ** 21 \
                 or self.bstate > curses.ALL_MOUSE_EVENTS:
-            return self.CTRL_SCROLLWHEEL_MULTIPLIER if self.ctrl() else 1
+            return self.repeat * (self.CTRL_SCROLLWHEEL_MULTIPLIER if self.ctrl() else 1)
         return 0
 
+    def same_wheel(self, other):
+        """Whether other scrolls the same way at the same place"""
+        return (self.bstate, self.x, self.y) == (other.bstate, other.x, other.y)
+
     def ctrl(self):
         return self.bstate & curses.BUTTON_CTRL
 
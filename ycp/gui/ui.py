@@ -4,9 +4,12 @@ import threading
 import os
 import sys
 import curses
+from time import perf_counter
 
 from .displayable import DisplayableContainer
+from . import color
 from ..misc.keybinding_parser import KeyBuffer, KeyLayout
+from ..misc.histogram import LatencyRecorder
 from ..services.signals import Signal
 from .mouse_event import MouseEvent, _setup_mouse
 from .widgets.titlebar import TitleBar
@@ -14,9 +17,12 @@ from .widgets.console import Console
 from .widgets.statusbar import StatusBar
 from .widgets.taskmanager import TaskManager
 from .widgets.pager import Pager
+from .widgets.framestats import FrameStats, FrameStatsOverlay
 
 ESCAPE_ICON_TITLE = '\033]1;'
 ALLOWED_VIEWMODES = 'miller', 'multipane'
+FRAME_STATS_SIZE = 8, 46
+MAX_DRAINED_INPUT = 256  # keys handled between two frames at most
 
 
 # TODO: add mice support
@@ -34,11 +40,18 @@ class UI(DisplayableContainer):
         self.titlebar = None
         self.viewmode = ALLOWED_VIEWMODES[0]
         self.selection_mode = None
-        self.taskmngr = None
+        self._taskmngr = None
         self.status = None
-        self.console = None
-        self.pager = None
+        self._console = None
+        self._pager = None
         self.browser = None
+        self.settings_snapshot = None
+        self.frame_stats = None
+        self._frame_stats_overlay = None
+        self.input_latency = LatencyRecorder()
+        self._input_start = None
+        self._input_command = None
+        self._coalesced = None
         # TODO: add multiplexer support
         self._draw_title = None
         if app is not None:
@@ -62,7 +75,11 @@ class UI(DisplayableContainer):
 
         curses.cbreak()
         curses.noecho()
-        curses.halfdelay(20)
+        # The event loop waits for input, getch() only takes what is there.
+        # Typeahead checks could read keys into curses' own buffer, where
+        # the event loop would not see them.
+        self.win.nodelay(True)
+        curses.typeahead(-1)
 
         try:
             curses.curs_set(int(bool(self.settings.show_cursor)))
@@ -111,19 +128,8 @@ class UI(DisplayableContainer):
 
     @load_mode.setter
     def load_mode(self, boolean):
-        boolean = bool(boolean)
-        if boolean != self.load_mode:
-            self._load_mode = boolean
-
-            if boolean:
-                # don't wait for key presses in the load mode
-                curses.cbreak()
-                self.win.nodelay(True)
-            else:
-                self.win.nodelay(False)
-                # Sanitize halfdelay setting
-                halfdelay = min(255, max(1, self.settings.idle_delay // 100))
-                curses.halfdelay(halfdelay)
+        # In the load mode, the main loop does not wait for events
+        self._load_mode = bool(boolean)
 
     def destroy(self):
         DisplayableContainer.destroy(self)
@@ -135,7 +141,17 @@ class UI(DisplayableContainer):
             event = MouseEvent(curses.getmouse())
         except curses.error:
             return
-        if not self.console.visible:
+        if not self.console_visible():
+            if event.mouse_wheel_direction():
+                # A burst of wheel events scrolls once, by all of them
+                pending = self._coalesced
+                if isinstance(pending, MouseEvent) and pending.same_wheel(event):
+                    pending.repeat += 1
+                    return
+                self.flush_coalesced()
+                self._coalesced = event
+                return
+            self.flush_coalesced()
             DisplayableContainer.click(self, event)
 
     def handle_key(self, key):
@@ -144,10 +160,17 @@ class UI(DisplayableContainer):
         if key < 0:
             self.keybuffer.clear()
 
-        elif not DisplayableContainer.press(self, key):
+        elif not self._press_focused(key):
             self.keylayouts.use_layout("browser")
             self.press(key)
 
+    def _press_focused(self, key):
+        """Pass key to the focused widget, e.g. the console, if there is one"""
+        if self.get_focused_obj() is None:
+            return False
+        self.flush_coalesced()
+        return DisplayableContainer.press(self, key)
+
     def press(self, key):
         keybuffer = self.keybuffer
         self.status.clear_message()
@@ -159,11 +182,14 @@ class UI(DisplayableContainer):
 
         if keybuffer.result is not None:
             try:
-                self.app.execute_console(
-                    keybuffer.result,
-                    wildcards=keybuffer.wildcards,
-                    quantifier=keybuffer.quantifier,
-                )
+                if not (keybuffer.finished_parsing and self._coalesce(
+                        keybuffer.result, keybuffer.wildcards, keybuffer.quantifier)):
+                    self.flush_coalesced()
+                    self.app.execute_console(
+                        keybuffer.result,
+                        wildcards=keybuffer.wildcards,
+                        quantifier=keybuffer.quantifier,
+                    )
             finally:
                 if keybuffer.finished_parsing:
                     keybuffer.clear()
@@ -172,19 +198,83 @@ class UI(DisplayableContainer):
             return False
         return True
 
+    def _coalesce(self, command, wildcards, quantifier):
+        """Hold back a motion to merge it with the same keys after it.
+
+        Returns False if the command has to run now.
+        """
+        try:
+            cmd_class = self.app.commands.get_command(command.split(None, 1)[0])
+        except (KeyError, ValueError, IndexError):
+            return False
+        if not cmd_class.coalesce:
+            return False
+        pending = self._coalesced
+        if isinstance(pending, tuple) and pending[:2] == (command, wildcards):
+            self._coalesced = (command, wildcards, (pending[2] or 1) + (quantifier or 1))
+        else:
+            self.flush_coalesced()
+            self._coalesced = (command, list(wildcards), quantifier)
+        return True
+
+    def flush_coalesced(self):
+        """Run the motion or wheel event that was held back, if any"""
+        pending, self._coalesced = self._coalesced, None
+        if pending is None:
+            return
+        if isinstance(pending, MouseEvent):
+            DisplayableContainer.click(self, pending)
+        else:
+            command, wildcards, quantifier = pending
+            self.app.execute_console(command, wildcards=wildcards, quantifier=quantifier)
+
+    def tag_input(self, name):
+        """Account the latency of the current key press to a command"""
+        if self._input_start is not None:
+            self._input_command = name
+
     def handle_keys(self, *keys):
         for key in keys:
             self.handle_key(key)
 
     def handle_input(self):
+        """Handle the next key and everything typed since, then return.
+
+        Pending input is drained without blocking, so holding a key or
+        spinning the mouse wheel costs one frame per batch instead of one
+        per event.  Repeats of a motion are merged on the way.
+        """
         key = self.win.getch()
+        if key >= 0 and key != curses.KEY_RESIZE:
+            self._input_start = perf_counter()
+            self._input_command = None
+        self._handle_input_key(key)
+        if key >= 0:
+            for _ in range(MAX_DRAINED_INPUT):
+                key = self.win.getch()
+                if key < 0:
+                    break
+                self._handle_input_key(key)
+        self.flush_coalesced()
+        self.request_frame(immediate=True)
+
+    def handle_resize(self):
+        """Called on SIGWINCH, which the event loop takes over from curses"""
+        try:
+            size = os.get_terminal_size(sys.stdout.fileno())
+        except OSError:
+            return
+        curses.resizeterm(size.lines, size.columns)
+        self.flush_coalesced()
+        self.update_size()
+        self.request_frame(immediate=True)
+
+    def _handle_input_key(self, key):
         if key == curses.KEY_ENTER:
             key = ord("\n")
         if key == 27 or (128 <= key < 256):
             # Handle special keys like ALT+X or unicode here:
             keys = [key]
-            previous_load_mode = self.load_mode
-            self._load_mode(True)
             for _ in range(4):
                 getkey = self.win.getch()
                 if getkey != -1:
@@ -200,17 +290,17 @@ class UI(DisplayableContainer):
             #     elif keys[0] == 194:
             #         keys = [ALT_KEY, keys[1] - 128] #TODO: uncommenting this
             self.handle_keys(*keys)
-            self._load_mode(previous_load_mode)
-            if self.settings.flushinput and not self.console.visible:
+            if self.settings.flushinput and not self.console_visible():
                 curses.flushinp()
         else:
             # Handle simple key presses, CTRL+X, etc here:
             if key >= 0:
-                if self.settings.flushinput and not self.console.visible:
+                if self.settings.flushinput and not self.console_visible():
                     curses.flushinp()
                 if key == curses.KEY_MOUSE:
                     self.handle_mouse()
                 elif key == curses.KEY_RESIZE:
+                    self.flush_coalesced()
                     self.update_size()
                 else:
                     if not self.app.input_is_blocked():
@@ -220,7 +310,11 @@ class UI(DisplayableContainer):
                 self.app.exit()
 
     def setup(self):
-        """Build up the UI by initializing widgets."""
+        """Build up the UI by initializing widgets.
+
+        The task manager, the console and the pager are hidden at startup,
+        so they are only built when they are first accessed.
+        """
 
         self.titlebar = TitleBar(self.win)
         self.add_child(self.titlebar)
@@ -231,41 +325,105 @@ class UI(DisplayableContainer):
         self.viewmode = self.settings.viewmode
         self.add_child(self.browser)  # TODO:Refactor this
 
-        self.taskmngr = TaskManager(self.win)
-        self.taskmngr.visible = False
-        self.add_child(self.taskmngr)
-
         self.status = StatusBar(self.win, self.browser.main_column)
         self.add_child(self.status)
 
-        self.console = Console(self.win)
-        self.add_child(self.console)
-        self.console.visible = False
+    def _build_hidden_widget(self, cls):
+        widget = cls(self.win)
+        widget.visible = False
+        self.add_child(widget)
+        if self.termsize is not None:
+            y, x = self.termsize
+            if cls is Console:
+                widget.resize(y - 1, 0, 1, x)
+            else:
+                widget.resize(1, 0, y - 2, x)
+        return widget
+
+    @property
+    def taskmngr(self):
+        if self._taskmngr is None:
+            self._taskmngr = self._build_hidden_widget(TaskManager)
+        return self._taskmngr
+
+    @property
+    def console(self):
+        if self._console is None:
+            self._console = self._build_hidden_widget(Console)
+        return self._console
+
+    @property
+    def pager(self):
+        if self._pager is None:
+            self._pager = self._build_hidden_widget(Pager)
+        return self._pager
+
+    def active_pager(self):
+        """Return the pager that is shown, full screen or embedded, or None"""
+        if self._pager is not None and self._pager.visible:
+            return self._pager
+        if self.browser.pager is not None and self.browser.pager.visible:
+            return self.browser.pager
+        return None
 
-        self.pager = Pager(self.win)
-        self.pager.visible = False
-        self.add_child(self.pager)
+    def console_visible(self):
+        """Like console.visible, without building the console"""
+        return self._console is not None and self._console.visible
 
     def redraw(self):
         """Redraw all widgets"""
         self.redrawlock.wait()
         self.redrawlock.clear()
+        start = perf_counter()
+        color.begin_frame()
+        self.settings_snapshot = self.settings.snapshot()
+        self._toggle_frame_stats(self.settings_snapshot.frame_stats)
         self.poke()
 
         # determine which widgets are shown
-        if self.console.wait_for_command_input or self.console.question_queue:
-            self.console.focused = True
-            self.console.visible = True
+        console = self._console
+        if console is not None and (console.wait_for_command_input
+                                    or console.question_queue):
+            console.focused = True
+            console.visible = True
             self.status.visible = False
         else:
-            self.console.focused = False
-            self.console.visible = False
+            if console is not None:
+                console.focused = False
+                console.visible = False
             self.status.visible = True
 
         self.draw()
         self.finalize()
+        end = perf_counter()
+        if self.frame_stats is not None:
+            self.frame_stats.record_frame(end - start)
+        if self._input_start is not None:
+            # the time from getch() until the result is on the screen
+            self.input_latency.record(self._input_command or '<key>',
+                                      end - self._input_start)
+            self._input_start = None
         self.redrawlock.set()
 
+    def _toggle_frame_stats(self, enabled):
+        if enabled and self.frame_stats is None:
+            self.frame_stats = FrameStats()
+            self._frame_stats_overlay = FrameStatsOverlay(self.win, self.frame_stats)
+            self._resize_frame_stats_overlay()
+        elif not enabled and self.frame_stats is not None:
+            self.frame_stats = None
+            self._frame_stats_overlay = None
+            # the overlay was painted over the other widgets
+            self.redraw_window()
+
+    def _resize_frame_stats_overlay(self):
+        if self._frame_stats_overlay is None or self.termsize is None:
+            return
+        y, x = self.termsize
+        hei, wid = FRAME_STATS_SIZE
+        hei, wid = min(hei, y - 1), min(wid, x)
+        self._frame_stats_overlay.resize(1, x - wid, hei, wid)
+
     def redraw_window(self):
         """Redraw the window. This only calls self.win.redrawwin()."""
         self.win.erase()
@@ -273,6 +431,8 @@ class UI(DisplayableContainer):
         self.win.refresh()
         self.win.redrawwin()
         self.need_redraw = True
+        if self.browser is not None:
+            self.browser.clear()
 
     def update_size(self):
         """resize all widgets"""
@@ -281,17 +441,23 @@ class UI(DisplayableContainer):
 
         self.browser.resize(
             self.settings.status_bar_on_top and 2 or 1, 0, y - 2, x)
-        self.taskmngr.resize(1, 0, y - 2, x)
-        self.pager.resize(1, 0, y - 2, x)
+        if self._taskmngr is not None:
+            self._taskmngr.resize(1, 0, y - 2, x)
+        if self._pager is not None:
+            self._pager.resize(1, 0, y - 2, x)
         self.titlebar.resize(0, 0, 1, x)
         self.status.resize(
             self.settings.status_bar_on_top and 1 or y - 1, 0, 1, x)
-        self.console.resize(y - 1, 0, 1, x)
+        if self._console is not None:
+            self._console.resize(y - 1, 0, 1, x)
+        self._resize_frame_stats_overlay()
 
     def draw(self):
         """Draw all objects in the container"""
         self.win.touchwin()
         DisplayableContainer.draw(self)
+        if self._frame_stats_overlay is not None:
+            self._frame_stats_overlay.draw()
         # if self._draw_title and self.settings.update_title:   #TODO: Refactor this
         #     cwd = self.app.thisdir.path
         #     if self.settings.tilde_in_titlebar \
@@ -329,8 +495,8 @@ class UI(DisplayableContainer):
         self.win.refresh()
 
     def draw_images(self):
-        if self.pager.visible:
-            self.pager.draw_image()
+        if self._pager is not None and self._pager.visible:
+            self._pager.draw_image()
         elif self.browser.pager:
             if self.browser.pager.visible:
                 self.browser.pager.draw_image()
@@ -338,17 +504,18 @@ class UI(DisplayableContainer):
                 self.browser.columns[-1].draw_image()
 
     def close_pager(self):
-        if self.console.visible:
+        if self.console_visible():
             self.console.focused = True
-        self.pager.close()
-        self.pager.visible = False
-        self.pager.focused = False
+        if self._pager is not None:
+            self._pager.close()
+            self._pager.visible = False
+            self._pager.focused = False
         self.browser.visible = True
 
     def open_pager(self):
         self.browser.columns[-1].clear_image(force=True)
-        if self.console.focused:
-            self.console.focused = False
+        if self._console is not None and self._console.focused:
+            self._console.focused = False
         self.pager.open()
         self.pager.visible = True
         self.pager.focused = True
@@ -379,10 +546,12 @@ class UI(DisplayableContainer):
 
     def open_taskview(self):  # TODO: Rename method
         self.browser.columns[-1].clear_image(force=True)
-        self.pager.close()
-        self.pager.visible = False
-        self.pager.focused = False
-        self.console.visible = False
+        if self._pager is not None:
+            self._pager.close()
+            self._pager.visible = False
+            self._pager.focused = False
+        if self._console is not None:
+            self._console.visible = False
         self.browser.visible = False
         self.taskmngr.visible = True
         self.taskmngr.focused = True
@@ -394,15 +563,25 @@ class UI(DisplayableContainer):
         self.status.need_redraw = True
 
     def close_taskview(self):  # TODO: Rename method
-        self.taskmngr.visible = False
+        if self._taskmngr is not None:
+            self._taskmngr.visible = False
+            self._taskmngr.focused = False
         self.browser.visible = True
-        self.taskmngr.focused = False
 
     def throbber(self, string='.', remove=False):
         if remove:
             self.titlebar.throbber = type(self.titlebar).throbber
         else:
             self.titlebar.throbber = string
+        self.request_frame()  # workers call this too
+
+    def request_frame(self, immediate=False):
+        """Ask the main loop for a frame.  Safe to call from any thread.
+
+        Frames for input are drawn at once, background updates at most
+        max_fps times a second.
+        """
+        self.app.frame_scheduler.request(immediate)
 
     def hint(self, text=None):
         self.status.hint = text
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 
-# from ... import PY3
 from ...misc.widestring import WideString, utf_char_width
 
 
@@ -114,12 +113,10 @@ class ColoredString(object):
         self.string = WideString(string)
         self.lst = lst
         self.fixed = False
-        if not string or not self.string.chars:
+        if not self.string.string:
             self.min_size = 0
-        elif PY3:
-            self.min_size = utf_char_width(string[0])
         else:
-            self.min_size = utf_char_width(self.string.chars[0].decode('utf-8'))
+            self.min_size = utf_char_width(self.string.string[0])
 
     def cut_off(self, n):
         if n >= 1:
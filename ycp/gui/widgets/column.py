@@ -5,13 +5,15 @@ import curses
 import stat
 from time import time
 from os.path import splitext
-from bidi.algorithm import get_display as get_bidi_text
 
+from ..context import context_mask
 from ..displayable import Widget
 from .pager import Pager
-from ...misc.widestring import WideString
+from ...misc.lru import LRUCache
+from ...misc.widestring import WideString, uwid
 
 DEFAULT_ROWMODE = "filename"
+DEFAULT_ROW_CACHE_SIZE = 4096
 
 
 def hook_before_drawing(fsobject, color_list):
@@ -20,6 +22,9 @@ def hook_before_drawing(fsobject, color_list):
 
 class BrowserColumn(Pager, Widget):
 
+    # The computed rows of all columns, see _draw_directory()
+    row_cache = LRUCache(DEFAULT_ROW_CACHE_SIZE)
+
     def __init__(self, win, level, tab=None):
         """Initializes a Browser Column Widget
 
@@ -38,9 +43,12 @@ class BrowserColumn(Pager, Widget):
         self.last_redraw_time = -1
         self.old_dir = None
         self.old_thisfile = None
+        self.old_copy_generation = None
         self.need_redraw = False
         self.image = None
         self.need_clear_image = True
+        # screen line -> key of the row that is painted there
+        self._painted = {}
         super(Pager, self).__init__(self, win)
         super(Widget, self).__init__(self, win)
         self.level = level
@@ -53,6 +61,22 @@ class BrowserColumn(Pager, Widget):
     def request_redraw(self):
         self.need_redraw = True
 
+    def forget_painted(self):
+        """Repaint every row on the next redraw.
+
+        Call this when the window was erased or painted over by someone
+        else, e.g. a parent erasing its own window.
+        """
+        self._painted.clear()
+
+    def _clear(self):
+        self.win.erase()
+        self._painted.clear()
+
+    def resize(self, y, x, hei=None, wid=None):
+        self._painted.clear()
+        Pager.resize(self, y, x, hei, wid)
+
     def click(self, event):
         """Handle a MouseEvent"""
         direction = event.mouse_wheel_direction()
@@ -138,6 +162,8 @@ class BrowserColumn(Pager, Widget):
         self.level = self.original_level
 
     def poke(self):
+        if self._old_visible != self.visible:
+            self._painted.clear()
         Widget.poke(self)
         if self.tab is None:
             tab = self.app.thistab
@@ -154,6 +180,11 @@ class BrowserColumn(Pager, Widget):
             self.old_dir = target
             self.scroll_extra = 0  # reset scroll start
 
+        copy_generation = self.app.copy_buffer.generation
+        if copy_generation != self.old_copy_generation:
+            self.need_redraw = True
+            self.old_copy_generation = copy_generation
+
         if target:
             target.use()
 
@@ -172,7 +203,10 @@ class BrowserColumn(Pager, Widget):
                 self.need_redraw |= self.last_redraw_time < target.last_load_time
 
         if self.need_redraw:
-            self.win.erase()
+            # Directories repaint only the rows that changed, see
+            # _draw_directory().  Everything else starts from scratch.
+            if target is None or not target.is_directory:
+                self._clear()
             if target is None:
                 pass
             elif target.is_file:
@@ -207,15 +241,16 @@ class BrowserColumn(Pager, Widget):
             Pager.draw(self)
 
     def _format_line_number(self, linum_format, i, selected_i):
+        settings = self.frame_settings
         line_number = i
-        if self.settings.line_numbers.lower() == 'relative':
+        if settings.line_numbers.lower() == 'relative':
             line_number = abs(selected_i - i)
-            if not self.settings.relative_current_zero and line_number == 0:
-                if self.settings.one_indexed:
+            if not settings.relative_current_zero and line_number == 0:
+                if settings.one_indexed:
                     line_number = selected_i + 1
                 else:
                     line_number = selected_i
-        elif self.settings.one_indexed:
+        elif settings.one_indexed:
             line_number += 1
 
         return linum_format.format(line_number)
@@ -227,7 +262,9 @@ class BrowserColumn(Pager, Widget):
             self.need_clear_image = True
             Pager.clear_image(self)
 
-        if self.level > 0 and not self.settings.preview_directories:
+        settings = self.frame_settings
+        if self.level > 0 and not settings.preview_directories:
+            self._clear()
             return
 
         base_color = ['in_browser']
@@ -241,6 +278,9 @@ class BrowserColumn(Pager, Widget):
         else:
             active_pane = False
 
+        if not self.target.content_loaded or not self.target.accessible \
+                or self.target.empty():
+            self._clear()
         self.win.move(0, 0)
 
         if not self.target.content_loaded:
@@ -266,7 +306,7 @@ class BrowserColumn(Pager, Widget):
 
         self._set_scroll_begin()
 
-        copied = [f.path for f in self.app.copy_buffer]
+        copied = self.app.copy_buffer.paths
 
         selected_i = self._get_index_of_selected_file()
 
@@ -278,19 +318,33 @@ class BrowserColumn(Pager, Widget):
         scroll_end = self.scroll_begin + min(self.hei, len(self.target)) - 1
         distance_to_top = selected_i - self.scroll_begin
         distance_to_bottom = scroll_end - selected_i
-        one_indexed_offset = 1 if self.settings.one_indexed else 0
+        one_indexed_offset = 1 if settings.one_indexed else 0
+        line_numbers = settings.line_numbers.lower()
 
-        if self.settings.line_numbers.lower() == "relative":
+        if line_numbers == "relative":
             linum_text_len = nr_of_digits(max(distance_to_top,
                                               distance_to_bottom))
-            if not self.settings.relative_current_zero:
+            if not settings.relative_current_zero:
                 linum_text_len = max(nr_of_digits(selected_i
                                                   + one_indexed_offset),
                                      linum_text_len)
         else:
             linum_text_len = nr_of_digits(scroll_end + one_indexed_offset)
         linum_format = "{0:>" + str(linum_text_len) + "}"
-
+        show_line_number = self.main_column and line_numbers != 'false'
+        painted = self._painted
+
+        # Rows are cached by a key made of everything that changes their
+        # looks.  The parts shared by all rows of this frame are in
+        # frame_key; the settings generation stands for every setting,
+        # colorscheme included, so old entries just age out of the LRU.
+        row_cache = self.row_cache
+        row_cache.resize(max(1, settings.row_cache_size or DEFAULT_ROW_CACHE_SIZE))
+        frame_key = (self.wid, self.main_column, self.target.has_vcschild,
+                     self.app.do_cut, active_pane, linum_text_len,
+                     settings.generation)
+
+        line = 0
         for line in range(self.hei):
             i = line + self.scroll_begin
 
@@ -314,33 +368,37 @@ class BrowserColumn(Pager, Widget):
                            for tag in current_linemode.required_metadata):
                     current_linemode = drawn.linemode_dict[DEFAULT_ROWMODE]
 
-            metakey = hash(repr(sorted(metadata.items()))) if metadata else 0
-            key = (self.wid, selected_i == i, drawn.marked, self.main_column,
-                   drawn.path in copied, tagged_marker, drawn.infostring,
-                   drawn.vcsstatus, drawn.vcsremotestatus, self.target.has_vcschild,
-                   self.app.do_cut, current_linemode.name, metakey, active_pane,
-                   self.settings.line_numbers.lower(), linum_text_len)
+            metaversion = self.app.metadata.version(drawn.path) \
+                if metadata is not None else 0
+            is_copied = drawn.path in copied
+            key = (drawn.path, frame_key, selected_i == i, drawn.marked,
+                   is_copied, tagged_marker, drawn.infostring,
+                   drawn.vcsstatus, drawn.vcsremotestatus,
+                   current_linemode.name, metaversion)
+
+            # Line numbers can't be reliably cached, so they are computed
+            # every time and are part of the key of the painted row.
+            line_number_text = self._format_line_number(
+                linum_format, i, selected_i) if show_line_number else None
+            row_key = (key, line_number_text)
+            if painted.get(line) == row_key:
+                continue
+            painted[line] = row_key
 
             # Check if current line has not already computed and cached
-            if key in drawn.display_data:
-                # Recompute line numbers because they can't be reliably cached.
-                if (
-                        self.main_column
-                        and self.settings.line_numbers.lower() != 'false'
-                ):
-                    line_number_text = self._format_line_number(linum_format,
-                                                                i,
-                                                                selected_i)
-                    drawn.display_data[key][0][0] = line_number_text
-
-                self.execute_curses_batch(line, drawn.display_data[key])
+            display_data = row_cache.get(key)
+            if display_data is not None:
+                if show_line_number:
+                    display_data[0][0] = line_number_text
+
+                self.execute_curses_batch(line, display_data)
                 self.color_reset()
                 continue
 
             text = current_linemode.filetitle(drawn, metadata)
 
             if drawn.marked and (self.main_column
-                                 or self.settings.display_tags_in_all_columns):
+                                 or settings.display_tags_in_all_columns):
                 text = " " + text
 
             # Computing predisplay data. predisplay contains a list of lists
@@ -352,11 +410,8 @@ class BrowserColumn(Pager, Widget):
             space = self.wid
 
             # line number field
-            if self.settings.line_numbers.lower() != 'false':
+            if line_numbers != 'false':
                 if self.main_column and space - linum_text_len > 2:
-                    line_number_text = self._format_line_number(linum_format,
-                                                                i,
-                                                                selected_i)
                     predisplay_left.append([line_number_text, ['line_number']])
                     space -= linum_text_len
 
@@ -411,19 +466,32 @@ class BrowserColumn(Pager, Widget):
             # ready to display in curses. It is a list of lists [string, attr]
 
             this_color = base_color + list(drawn.mimetype_tuple) + \
-                self._draw_directory_color(i, drawn, copied)
+                self._draw_directory_color(i, drawn, is_copied)
             display_data = []
-            drawn.display_data[key] = display_data
+            row_cache[key] = display_data
 
             drawn, this_color = hook_before_drawing(drawn, this_color)
 
             predisplay = predisplay_left + predisplay_right
+            get_attr_for_mask = settings.colorscheme.get_attr_for_mask
+            row_mask = context_mask(this_color)
             for txt, color in predisplay:
-                attr = self.settings.colorscheme.get_attr(*(this_color + color))
+                attr = get_attr_for_mask(row_mask | context_mask(color))
                 display_data.append([txt, attr])
 
             self.execute_curses_batch(line, display_data)
             self.color_reset()
+        else:
+            line = self.hei
+
+        # Clear the rows that were painted last time but are empty now
+        for stale in [row for row in painted if row >= line]:
+            del painted[stale]
+            try:
+                self.win.move(stale, 0)
+                self.win.clrtoeol()
+            except curses.error:
+                pass
 
     def _get_index_of_selected_file(self):
         if self.app.ui.viewmode == 'multipane' and self.tab != self.app.thistab:
@@ -432,13 +500,13 @@ class BrowserColumn(Pager, Widget):
 
     @staticmethod
     def _total_len(predisplay):
-        return sum(len(WideString(s)) for s, _ in predisplay)
+        return sum(uwid(s) for s, _ in predisplay)
 
     def _draw_text_display(self, text, space):
-        bidi_text = get_bidi_text(text)
+        bidi_text = self.bidi_transpose(text)
         wtext = WideString(bidi_text)
         wext = WideString(splitext(bidi_text)[1])
-        wellip = WideString(self.ellipsis[self.settings.unicode_ellipsis])
+        wellip = WideString(self.ellipsis[self.frame_settings.unicode_ellipsis])
         if len(wtext) > space:
             wtext = wtext[:max(1, space - len(wext) - len(wellip))] + wellip + wext
         # Truncate again if still too long.
@@ -449,7 +517,7 @@ class BrowserColumn(Pager, Widget):
 
     def _draw_tagged_display(self, tagged, tagged_marker):
         tagged_display = []
-        if (self.main_column or self.settings.display_tags_in_all_columns) \
+        if (self.main_column or self.frame_settings.display_tags_in_all_columns) \
                 and self.wid > 2:
             if tagged:
                 tagged_display.append([tagged_marker, ['tag_marker']])
@@ -460,7 +528,7 @@ class BrowserColumn(Pager, Widget):
     def _draw_infostring_display(self, drawn, space):
         infostring_display = []
         if self.display_infostring and drawn.infostring \
-                and self.settings.display_size_in_main_column:
+                and self.frame_settings.display_size_in_main_column:
             infostring = str(drawn.infostring)
             if len(infostring) <= space:
                 infostring_display.append([infostring, ['infostring']])
@@ -485,7 +553,7 @@ class BrowserColumn(Pager, Widget):
 
         return vcsstring_display
 
-    def _draw_directory_color(self, i, drawn, copied):
+    def _draw_directory_color(self, i, drawn, is_copied):
         this_color = []
         if i == self._get_index_of_selected_file():
             this_color.append('selected')
@@ -512,7 +580,7 @@ class BrowserColumn(Pager, Widget):
             if drawn.is_device:
                 this_color.append('device')
 
-        if drawn.path in copied:
+        if is_copied:
             this_color.append('cut' if self.app.do_cut else 'copied')
 
         if drawn.is_link:
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Frame time instrumentation and the overlay that displays it.
+
+When the setting "frame_stats" is on, the UI hands a FrameStats object to
+the DisplayableContainers, which time the poke(), draw() and finalize()
+calls of every child.  The FrameStatsOverlay in the top right corner shows
+the frame time and the widget phases with the worst 95th percentile.
+"""
+
+import math
+from collections import deque
+
+from ..displayable import Displayable
+
+WINDOW = 120  # frames kept for the rolling percentiles
+TOP_OFFENDERS = 6
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a sequence of numbers
+
+    >>> percentile([5, 1, 4, 2, 3], 50)
+    3
+    >>> percentile([5, 1, 4, 2, 3], 95)
+    5
+    >>> percentile([], 50)
+    0.0
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class FrameStats:
+    """Rolling poke/draw/finalize durations per widget, in seconds."""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.frames = deque(maxlen=window)
+        self.timings = {}
+
+    def record(self, displayable, phase, duration):
+        key = (str(displayable), phase)
+        try:
+            self.timings[key].append(duration)
+        except KeyError:
+            self.timings[key] = deque([duration], maxlen=self.window)
+
+    def record_frame(self, duration):
+        self.frames.append(duration)
+
+    def top_offenders(self, n=TOP_OFFENDERS, pct=95):
+        """Return [(duration, widget name, phase)] with the slowest first"""
+        worst = sorted(((percentile(samples, pct), name, phase)
+                        for (name, phase), samples in self.timings.items()),
+                       reverse=True)
+        return worst[:n]
+
+
+class FrameStatsOverlay(Displayable):
+
+    def __init__(self, win, stats):
+        super().__init__(win)
+        self.stats = stats
+
+    def draw(self):
+        frames = self.stats.frames
+        lines = [
+            'frame p50 {0:6.2f}  p95 {1:6.2f}  max {2:6.2f} ms'.format(
+                percentile(frames, 50) * 1000, percentile(frames, 95) * 1000,
+                max(frames, default=0.0) * 1000),
+            '  p95 ms  widget',
+        ]
+        for duration, name, phase in self.stats.top_offenders():
+            lines.append('{0:8.2f}  {1} {2}'.format(duration * 1000, name, phase))
+
+        self.win.erase()
+        self.color('in_statusbar', 'message')
+        for i, line in enumerate(lines[:self.hei]):
+            self.addnstr(i, 0, line.ljust(self.wid), self.wid)
+        self.color_reset()
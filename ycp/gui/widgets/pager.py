@@ -1,13 +1,25 @@
 # -*- coding: utf-8 -*-
 
 import curses
+import os
+import re
+import stat
 
 from .. import ansi
+from ..color import get_preview_color, REVERSE
 from ..direction import Direction
+from ..wrap_index import WrapIndex
 from ...misc.img_display import ImgDisplayUnsupportedException
+from ...misc.line_search import LineSearch
+from ...misc.lru import LRUCache
+from ...misc.mapped_lines import MappedLines
+from ...misc.stream_reader import StreamReader
 
 from ..displayable import Widget
 
+SEGMENT_CACHE_SIZE = 2048
+MAPPED_SOURCE_SIZE = 16 << 20  # regular files from this size on are mapped
+
 
 # TODO: Scrolling in embedded pager
 class Pager(Widget):
@@ -15,6 +27,8 @@ class Pager(Widget):
     def __init__(self, win, embedded=False):
         self.source = None
         self.source_is_stream = False
+        self.source_is_mapped = False
+        self.stream_reader = None
         self.old_source = None
         self.old_scroll_begin = 0
         self.old_startx = 0
@@ -30,16 +44,48 @@ class Pager(Widget):
         self.lines = []
         self.image = None
         self.image_drawn = False
+        # source line -> [(text, fg, bg, attr, width)]
+        self._segment_cache = LRUCache(SEGMENT_CACHE_SIZE)
+        self._wrap_index = None
+        self.line_search = None
+        self._search_from = None
+        # Showing the end of a mapped file whose index is not complete yet
+        self._at_end = False
 
     def _close_source(self):
-        if self.source and self.source_is_stream:
+        if self.source_is_mapped:
+            self.lines.close()
+            self.lines = []
+        if self.stream_reader is not None:
+            # closing the stream here could block until the reader's
+            # readline() returns, so the reader closes it
+            self.stream_reader.stop()
+            self.stream_reader = None
+        elif self.source and (self.source_is_stream or self.source_is_mapped):
             try:
                 self.source.close()
             except OSError as ex:
                 pass
+        self.source_is_mapped = False
+
+    @staticmethod
+    def _map_source(source):
+        """Return MappedLines for a large regular file, None otherwise"""
+        try:
+            fileno = source.fileno()
+            fstat = os.fstat(fileno)
+        except (AttributeError, OSError, ValueError):
+            return None
+        if not stat.S_ISREG(fstat.st_mode) or fstat.st_size < MAPPED_SOURCE_SIZE:
+            return None
+        try:
+            return MappedLines(source, getattr(source, 'encoding', None) or 'utf-8')
+        except (OSError, ValueError):
+            return None
 
     def open(self):
         self.scroll_begin = 0
+        self._at_end = False
         self.markup = None
         self.max_width = 0
         self.startx = 0
@@ -55,6 +101,7 @@ class Pager(Widget):
         if self.image:
             self.need_clear_image = True
             self.clear_image()
+        self._stop_search()
         self._close_source()
 
     def destroy(self):
@@ -65,8 +112,10 @@ class Pager(Widget):
         self.app.ui.win.move(self.y, self.x)
 
     def scrollbit(self, lines):
+        self._resolve_end()
         target_scroll = self.scroll_extra + lines
-        max_scroll = len(self.lines) - self.hei
+        max_scroll = self._row_count(self.scroll_begin + target_scroll
+                                     + self.hei) - self.hei
         self.scroll_extra = max(0, min(target_scroll, max_scroll))
         self.need_redraw = True  # FIXME: Replace this attribute
 
@@ -74,10 +123,16 @@ class Pager(Widget):
         if self.need_clear_image:
             self.need_redraw = True
 
+        if self._search_from is not None:
+            self._jump_to_first_match()
+
         if self.old_source != self.source:
             self.old_source = self.source
             self.need_redraw = True
 
+        if self._at_end and self._lines_complete():
+            self._resolve_end()
+
         if self.old_scroll_begin != self.scroll_begin or \
                 self.old_startx != self.startx:
             self.old_startx = self.startx
@@ -90,9 +145,12 @@ class Pager(Widget):
             self.clear_image()
 
             if not self.image:
-                scroll_pos = self.scroll_begin + self.scroll_extra
-                line_gen = self._generate_lines(
-                    starty=scroll_pos, startx=self.startx)
+                if self._at_end:
+                    line_gen = self._generate_last_lines(self.startx)
+                else:
+                    scroll_pos = self.scroll_begin + self.scroll_extra
+                    line_gen = self._generate_lines(
+                        starty=scroll_pos, startx=self.startx)
 
                 for line, i in zip(line_gen, range(self.hei)):
                     self._draw_line(i, line)
@@ -122,14 +180,18 @@ class Pager(Widget):
             except curses.error:
                 pass
             else:
-                for chunk in ansi.text_with_fg_bg_attr(line):
-                    if isinstance(chunk, tuple):
-                        self.set_fg_bg_attr(*chunk)
-                    else:
-                        self.addstr(chunk)
+                # Pairs are looked up on every draw, so the ones on screen
+                # are the last to be recycled
+                for text, fg, bg, attr, _ in line:
+                    self.addstr(text, curses.color_pair(get_preview_color(fg, bg)) | attr)
 
     def move(self, narg=None, **kw):
         direction = Direction(kw)
+        if self.source_is_mapped:
+            # grows while the lines are indexed
+            self.max_width = self.lines.max_length
+        elif self.stream_reader is not None:
+            self.max_width = self.stream_reader.max_length
         if direction.horizontal():
             self.startx = direction.move(
                 direction=direction.right(),
@@ -139,6 +201,9 @@ class Pager(Widget):
                 pagesize=self.wid,
                 offset=-self.wid + 1)
         if direction.vertical():
+            if direction.relative():
+                self._resolve_end()
+            self._at_end = False
             movement = {
                 "direction": direction.down(),
                 "override": narg,
@@ -146,19 +211,57 @@ class Pager(Widget):
                 "pagesize": self.hei,
                 "offset": -self.hei + 1,
             }
-            if self.source_is_stream:
-                # For streams, we first pretend that the content ends much later,
-                # in case there are still unread lines.
+            if self.source_is_mapped and not self.lines.complete \
+                    and self._move_mapped(direction, movement):
+                return
+            # With wrapping, positions count screen rows instead of lines.
+            if self.source_is_stream or self._get_wrap_index() is not None:
+                # First pretend that the content ends much later, in case
+                # there are still unread or unwrapped lines.
                 desired_position = direction.move(
-                    maximum=len(self.lines) + 9999,
+                    maximum=self._row_count() + 9999,
                     **movement)
-                # Then, read the new lines as needed to produce a more accurate
-                # maximum for the movement:
-                self._get_line(desired_position + self.hei)
+                # Then wrap the lines (or ask the stream reader for them)
+                # as needed to produce a more accurate maximum:
+                self._row_count(desired_position + self.hei)
             self.scroll_begin = direction.move(
-                maximum=len(self.lines),
+                maximum=self._row_count(),
                 **movement)
 
+    def _move_mapped(self, direction, movement):
+        """Prepare a move in a mapped file that is still being indexed
+
+        Returns True if the move went to the end, which is shown from the
+        end of the file until the index catches up.  Otherwise, waits
+        for the lines the move needs.
+        """
+        if direction.percentage():
+            self.lines.wait()  # a percentage of all lines
+            return False
+        maximum = self._row_count() + 9999
+        desired = direction.move(maximum=maximum, **movement)
+        if desired >= maximum - self.hei:
+            if self._get_wrap_index() is not None:
+                self.lines.wait()  # the rows of every line are needed
+                return False
+            self._at_end = True
+            self.need_redraw = True
+            return True
+        if self._get_wrap_index() is None:
+            self.lines.wait(desired + self.hei)
+        return False
+
+    def _resolve_end(self):
+        """Turn showing the end into a position, indexing all lines"""
+        if not self._at_end:
+            return
+        self._at_end = False
+        if self.source_is_mapped:
+            self.lines.wait()
+        self.scroll_begin = max(0, self._row_count() - self.hei)
+        self.scroll_extra = 0
+        self.need_redraw = True
+
     def press(self, key):
         self.app.ui.keymaps.use_keymap('pager')
         self.app.ui.press(key)
@@ -167,6 +270,7 @@ class Pager(Widget):
         if self.image:
             self.need_clear_image = True
         self.image = image
+        self._stop_search()
         self._close_source()
         self.source = None
         self.source_is_stream = False
@@ -175,8 +279,12 @@ class Pager(Widget):
         if self.image:
             self.image = None
             self.need_clear_image = True
+        # The search reads the lines, stop it before they are closed
+        self._stop_search()
         self._close_source()
+        self._at_end = False
 
+        self._wrap_index = None
         self.max_width = 0
         if isinstance(source, str):
             self.source_is_stream = False
@@ -189,15 +297,24 @@ class Pager(Widget):
             if self.lines:
                 self.max_width = max(len(line) for line in source)
         elif hasattr(source, 'readline'):
-            self.source_is_stream = True
-            self.lines = []
+            mapped = self._map_source(source)
+            if mapped is not None:
+                self.source_is_stream = False
+                self.source_is_mapped = True
+                self.lines = mapped
+            else:
+                self.source_is_stream = True
+                self.lines = []
+                self.stream_reader = StreamReader(source, self.lines,
+                                                  self._stream_updated)
         else:
             self.source = None
             self.source_is_stream = False
             return False
         self.markup = 'ansi'
 
-        if not self.source_is_stream and strip:
+        # Mapped files are too large to be copied into a list
+        if not self.source_is_stream and not self.source_is_mapped and strip:
             self.lines = [line.strip() for line in self.lines]
 
         self.source = source
@@ -215,36 +332,201 @@ class Pager(Widget):
         try:
             return self.lines[n]
         except (KeyError, IndexError):
-            if attempt_to_read and self.source_is_stream:
-                try:
-                    for line in self.source:
-                        if len(line) > self.max_width:
-                            self.max_width = len(line)
-                        self.lines.append(line)
-                        if len(self.lines) > n:
-                            break
-                except (UnicodeError, IOError):
-                    pass
-                return self._get_line(n, attempt_to_read=False)
+            if attempt_to_read and self.stream_reader is not None:
+                # the line is drawn once the reader has it
+                self.stream_reader.request(n + 1)
             return ""
 
+    def _stream_updated(self):
+        """Called by the stream reader thread when it read new lines"""
+        self.need_redraw = True
+        self.app.ui.request_frame()
+
+    def _get_segments(self, line):
+        """Return the line as a list of (text, fg, bg, attr, width) runs.
+
+        Lines are parsed only once; later frames, horizontal scrolling and
+        wrapping work on the cached runs.
+        """
+        segments = self._segment_cache.get(line)
+        if segments is None:
+            segments = ansi.tokenize(line.expandtabs(4).rstrip('\r\n'))
+            self._segment_cache[line] = segments
+        return segments
+
+    def search(self, pattern):
+        """Search the lines for a regular expression in the background.
+
+        The pattern is case-insensitive unless it has upper case letters.
+        The pager scrolls to the first match from the top line on, and
+        search_next() moves between the matches.  Raises re.error for an
+        invalid pattern.
+        """
+        regex = re.compile(pattern, 0 if pattern.lower() != pattern else re.IGNORECASE)
+        self._stop_search()
+        if self.stream_reader is not None:
+            wait_for_lines = self.stream_reader.wait_for
+        elif self.source_is_mapped:
+            wait_for_lines = self.lines.wait
+        else:
+            wait_for_lines = None
+        self.line_search = LineSearch(self.lines, regex, self._plain_text,
+                                      self._lines_complete, self._search_updated,
+                                      wait_for_lines)
+        self._search_from = self._top_line()
+        self.need_redraw = True
+
+    def search_next(self, forward=True, count=1):
+        """Scroll to the count-th next (or previous) match
+
+        Returns False if there is no search or no such match.
+        """
+        if self.line_search is None:
+            return False
+        line = top = self._top_line()
+        for _ in range(count):
+            match = self.line_search.next_match(line, forward)
+            if match is None:
+                break
+            line = match
+        if line == top:
+            return False
+        self._scroll_to_line(line)
+        return True
+
+    def _stop_search(self):
+        if self.line_search is not None:
+            self.line_search.stop()
+            self.line_search = None
+        self._search_from = None
+
+    def _jump_to_first_match(self):
+        search = self.line_search
+        match = search.next_match(self._search_from - 1)
+        if match is not None:
+            self._search_from = None
+            self._scroll_to_line(match)
+        elif search.finished:
+            self._search_from = None
+            self.app.notify("Pattern not found: " + search.regex.pattern, bad=True)
+
+    def _search_updated(self):
+        """Called by the search thread when it found new matches"""
+        self.need_redraw = True
+        self.app.ui.request_frame()
+
+    @staticmethod
+    def _plain_text(line):
+        """The text of a line as _get_segments() shows it, for the search"""
+        return ansi.ansi_re.sub('', line.expandtabs(4).rstrip('\r\n'))
+
+    def _lines_complete(self):
+        if self.source_is_mapped:
+            return self.lines.complete
+        if self.stream_reader is not None:
+            return self.stream_reader.finished
+        return True
+
+    def _top_line(self):
+        """The number of the source line at the top of the pager"""
+        self._resolve_end()
+        row = self.scroll_begin + self.scroll_extra
+        index = self._get_wrap_index()
+        if index is None:
+            return row
+        location = index.locate(row)
+        return location[0] if location is not None else max(0, len(self.lines) - 1)
+
+    def _scroll_to_line(self, line):
+        self._at_end = False
+        index = self._get_wrap_index()
+        self.scroll_begin = index.row_of(line) if index is not None else line
+        self.scroll_extra = 0
+        self.need_redraw = True
+
+    def _line_width(self, n):
+        """Return the display width of line n, IndexError past the end"""
+        line = self._get_line(n)
+        if n >= len(self.lines):
+            if self.stream_reader is not None \
+                    and not self.stream_reader.finished:
+                return None
+            raise IndexError(n)
+        if self.markup == 'ansi':
+            return sum(segment[-1] for segment in self._get_segments(line))
+        return len(line.expandtabs(4))
+
+    def _get_wrap_index(self):
+        """Return the WrapIndex if lines are wrapped, None otherwise
+
+        The index is built again when the width changes.
+        """
+        if not self.app.settings.wrap_plaintext_previews or not self.source:
+            return None
+        index = self._wrap_index
+        if index is None or index.width != max(1, self.wid):
+            index = self._wrap_index = WrapIndex(self.wid, self._line_width)
+        return index
+
+    def _row_count(self, upto=None):
+        """The number of screen rows known, reading up to row upto"""
+        index = self._get_wrap_index()
+        if index is not None:
+            if upto is not None:
+                index.extend(upto)
+            return index.rows
+        if upto is not None and self.source_is_stream:
+            self._get_line(upto)
+        return len(self.lines)
+
+    def _generate_last_lines(self, startx):
+        """Yield the visible parts of the last lines of a mapped file.
+
+        Matches are highlighted once the index is complete and the lines
+        have their numbers.
+        """
+        for line in self.lines.tail(self.hei):
+            if self.markup == 'ansi':
+                yield ansi.slice_segments(self._get_segments(line), startx, self.wid)
+            else:
+                yield line.expandtabs(4)[startx:startx + self.wid].rstrip()
+
     def _generate_lines(self, starty, startx):
-        i = starty
+        """Yield the visible parts of the lines from screen row starty on.
+
+        With ansi markup, each part is a list of (text, fg, bg, attr, width)
+        runs, as _get_segments() returns them, otherwise it is a string.
+        """
         if not self.source:
             return
+        index = self._get_wrap_index()
+        if index is None:
+            i, first_part = starty, 0
+        else:
+            location = index.locate(starty)
+            if location is None:
+                return
+            i, first_part = location
         while True:
             try:
-                line = self._get_line(i).expandtabs(4)
-                for part in ((0,) if not self.app.settings.wrap_plaintext_previews
-                else range(max(1, ((len(line) - 1) // self.wid) + 1))):  # FIXME: Refactor this line
-                    shift = part * self.wid
-                    if self.markup == 'ansi':
-                        line_bit = (ansi.char_slice(line, startx + shift,
-                                                    self.wid + shift)
-                                    + ansi.reset)
-                    else:
-                        line_bit = line[startx + shift:self.wid + startx + shift]
-                    yield line_bit.rstrip().replace('\r\n', '\n')
+                line = self._get_line(i)
             except IndexError:
                 return
+            if self.markup == 'ansi':
+                segments = self._get_segments(line)
+                width = sum(segment[-1] for segment in segments)
+                spans = self.line_search.spans.get(i) if self.line_search else None
+                if spans:
+                    segments = ansi.highlight_segments(segments, spans, REVERSE)
+            else:
+                line = line.expandtabs(4)
+                width = len(line)
+            parts = index.parts(width) if index is not None else 1
+            for part in range(first_part, parts):
+                shift = startx + part * self.wid
+                if self.markup == 'ansi':
+                    yield ansi.slice_segments(segments, shift, self.wid)
+                else:
+                    yield line[shift:shift + self.wid].rstrip().replace('\r\n', '\n')
+            first_part = 0
             i += 1
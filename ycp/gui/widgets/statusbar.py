@@ -5,7 +5,7 @@ import os
 from os import getuid, readlink
 from pwd import getpwuid
 from grp import getgrgid
-from time import time, strftime, localtime
+from time import monotonic, strftime, localtime
 
 from ...misc.human_readable import human_readable
 from .bar import Bar
@@ -21,6 +21,7 @@ class StatusBar(Widget):  # FIXME: Refactor this class
         self.timeformat = '%Y-%m-%d %H:%M'
         self.hint = None
         self.msg = None
+        self._expiry = None
         self.old_thisfile = None
         self.old_ctime = None
         self.old_du = None
@@ -35,9 +36,14 @@ class StatusBar(Widget):  # FIXME: Refactor this class
 
     def request_redraw(self):
         self.need_redraw = True
+        self.app.ui.request_frame(immediate=True)
 
     def notify(self, text, duration=0, bad=False):
         self.msg = Message(text, duration, bad)
+        # Wake the main loop to take the message down when it expires
+        if self._expiry is not None:
+            self._expiry.cancel()
+        self._expiry = self.app.event_loop.call_later(duration, self.request_redraw)
 
     def clear_message(self):
         self.msg = None
@@ -343,7 +349,7 @@ class Message(object):
     def __init__(self, text, duration, bad):
         self.text = text
         self.bad = bad
-        self.elapse = time() + duration
+        self.elapse = monotonic() + duration
 
     def is_alive(self):
-        return time() <= self.elapse
+        return monotonic() <= self.elapse
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 
 from os.path import basename
-from bidi.algorithm import get_display
 
 from .bar import Bar
 from ..displayable import Widget
@@ -108,13 +107,13 @@ class TitleBar(Widget):
                 else:
                     clr = 'directory'
 
-                bidi_basename = get_display(path.basename)  # TODO: Test it
+                bidi_basename = self.bidi_transpose(path.basename)  # TODO: Test it
                 bar.add(bidi_basename, clr, directory=path)
                 bar.add('/', clr, fixed=True, directory=path)
 
             if self.app.thisfile is not None and \
                     self.settings.show_selection_in_titlebar:
-                bidi_file_path = get_display(self.app.thisfile.relative_path)
+                bidi_file_path = self.bidi_transpose(self.app.thisfile.relative_path)
                 bar.add(bidi_file_path, 'file')
         else:
             path = self.app.thistab.path
@@ -2,10 +2,8 @@
 
 
 import curses
-from itertools import groupby
 
 from ...config import settings
-from ...misc.keybinding_parser import key_to_string
 from ..displayable import Widget
 from .column import BrowserColumn
 from .pager import Pager
@@ -29,11 +27,17 @@ class View(Widget, DisplayableContainer):
     def request_clear(self):
         self.need_clear = True
 
+    def clear(self):
+        """Erase the window, the columns have to repaint all their rows"""
+        self.win.erase()
+        self.need_redraw = True
+        self.need_clear = False
+        for column in self.columns or ():
+            column.forget_painted()
+
     def draw(self):
         if self.need_clear:
-            self.win.erase()
-            self.need_redraw = True
-            self.need_clear = False
+            self.clear()
         for tab in self.app.tabs.values():
             directory = tab.thisdir
             if directory:
@@ -110,66 +114,7 @@ class View(Widget, DisplayableContainer):
         self.columns[-1].clear_image(force=True)
         self.color_reset()
         self.need_clear = True
-        hints = []
-
-        def populate_hints(keymap, prefix=""):
-            for k, v in keymap.items():  # FIXME: Refactor this attribute
-                k = prefix + key_to_string(k)
-                if isinstance(v, dict):
-                    populate_hints(v, k)
-                else:
-                    text = v
-                    if text.startswith('hint') or text.startswith('chain hint'):
-                        continue
-                    hints.append((key, text))
-
-        populate_hints(self.app.ui.keybuffer.pointer)
-
-        def sort_hints(hints):  # FIXME: Refactor or delete this method
-            """Sort the hints by the action string but first group them by the
-            first key.
-
-            """
-
-            # groupby needs the list to be sorted.
-            hints.sort(key=lambda t: t[0])
-
-            def group_hints(hints):
-                def first_key(hint):
-                    return hint[0][0]
-
-                def action_string(hint):
-                    return hint[1]
-
-                return (sorted(group, key=action_string)
-                        for _, group
-                        in groupby(
-                    hints,
-                    key=first_key))
-
-            grouped_hints = group_hints(hints)
-
-            # If there are too many hints, collapse the sublists.
-            if len(hints) > self.app.settings.hint_collapse_threshold:
-                def first_key_in_group(group):
-                    return group[0][0][0]
-
-                grouped_hints = (
-                    [(first_key_in_group(hint_group), "...")]
-                    if len(hint_group) > 1
-                    else hint_group
-                    for hint_group in grouped_hints
-                )
-
-            # Sort by the first action in group.
-            grouped_hints = sorted(grouped_hints, key=lambda g: g[0][1])
-
-            def flatten(nested_list):
-                return [item for inner_list in nested_list for item in inner_list]
-
-            return flatten(grouped_hints)
-
-        hints = sort_hints(hints)
+        hints = self.app.ui.keybuffer.hints(self.app.settings.hint_collapse_threshold)
 
         hei = min(self.hei - 1, len(hints))
         ystart = self.hei - hei
@@ -199,6 +144,11 @@ class View(Widget, DisplayableContainer):
         DisplayableContainer.resize(self, y, x, hei, wid)
 
     def poke(self):  # FIXME: Check up implementation
+        if self._old_visible != self.visible:
+            # Hidden by the pager or the task view, which paint over the
+            # same screen area, or erased by Displayable.poke()
+            for column in self.columns or ():
+                column.forget_painted()
         DisplayableContainer.poke(self)
 
 
@@ -276,9 +226,7 @@ class MillerView(View):
 
     def draw(self):
         if self.need_clear:
-            self.win.erase()
-            self.need_redraw = True  # FIXME: Replace or/and rename attribute
-            self.need_clear = False
+            self.clear()
         for tab in self.app.tabs.values():
             directory = tab.thisdir
             if directory:
@@ -525,9 +473,7 @@ class MultipaneView(View):
 
     def draw(self):
         if self.need_clear:
-            self.win.erase()
-            self.need_redraw = True  # FIXME: Rename or/and replace attribute
-            self.need_clear = False
+            self.clear()
 
         View.draw(self)
 
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""Where the lines of a wrapped text start on the screen.
+
+For each source line the index stores the number of screen rows taken by
+it and all lines before it.  It is filled in lazily, only as far as the
+rows that are asked for, and maps a screen row to (line, part) with a
+binary search.
+"""
+
+from array import array
+from bisect import bisect_right
+
+
+class WrapIndex:
+    """Cumulative screen rows of lines wrapped at width cells
+
+    line_width(n) returns the width of line n and raises IndexError past
+    the last line.  It returns None if line n is not available yet, e.g.
+    while a stream is read; the index then stops there for now.
+
+    >>> index = WrapIndex(4, [3, 9, 0, 4].__getitem__)
+    >>> index.locate(0), index.locate(1), index.locate(3), index.locate(5)
+    ((0, 0), (1, 0), (1, 2), (3, 0))
+    >>> index.locate(6) is None, index.rows
+    (True, 6)
+    """
+
+    def __init__(self, width, line_width):
+        self.width = max(1, width)
+        self._line_width = line_width
+        self._rows = array('Q')
+        self.complete = False
+
+    @property
+    def rows(self):
+        """The number of screen rows indexed so far"""
+        return self._rows[-1] if self._rows else 0
+
+    def parts(self, line_width):
+        return max(1, (line_width - 1) // self.width + 1)
+
+    def extend(self, row):
+        """Index lines until screen row is covered or the text ends"""
+        rows = self._rows
+        total = self.rows
+        while total <= row and not self.complete:
+            try:
+                width = self._line_width(len(rows))
+            except IndexError:
+                self.complete = True
+                break
+            if width is None:
+                break
+            total += self.parts(width)
+            rows.append(total)
+
+    def row_of(self, line):
+        """Return the first screen row of line"""
+        rows = self._rows
+        while len(rows) < line and not self.complete:
+            indexed = len(rows)
+            self.extend(self.rows)
+            if len(rows) == indexed:
+                break  # line is not available yet
+        if not line:
+            return 0
+        return rows[min(line, len(rows)) - 1] if rows else 0
+
+    def locate(self, row):
+        """Return (line, part) shown at screen row, None past the end"""
+        self.extend(row)
+        line = bisect_right(self._rows, row)
+        if line >= len(self._rows):
+            return None
+        return line, row - (self._rows[line - 1] if line else 0)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""Latency histograms with a bounded relative error, in the style of HDR.
+
+Values are counted in microseconds.  Below 2**SUB_BUCKET_BITS every value
+has its own bucket; above that, each power of two is split into
+2**(SUB_BUCKET_BITS - 1) equal buckets, so a reported value is never off
+by more than 1 / 2**(SUB_BUCKET_BITS - 1) of itself (about 1.6%).  The
+buckets are kept in a dict, so memory grows with the number of distinct
+buckets, not with the number of samples.
+"""
+
+import math
+
+SUB_BUCKET_BITS = 7
+PERCENTILES = (50, 95, 99)
+
+
+def _bucket(value):
+    shift = max(0, value.bit_length() - SUB_BUCKET_BITS)
+    return shift, value >> shift
+
+
+def _bucket_value(bucket):
+    """The highest value that falls into the bucket"""
+    shift, sub = bucket
+    return ((sub + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """Counts durations in log-linear buckets
+
+    >>> hist = LatencyHistogram()
+    >>> for ms in range(1, 101):
+    ...     hist.record(ms / 1000)
+    >>> hist.count
+    100
+    >>> round(hist.percentile(50) * 1000)
+    50
+    >>> round(hist.percentile(99) * 1000)
+    99
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.max = 0
+
+    def record(self, seconds):
+        value = max(0, int(seconds * 1000000))
+        bucket = _bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        """Return the pct-th percentile in seconds"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(_bucket_value(bucket), self.max) / 1000000
+        return self.max / 1000000
+
+
+class LatencyRecorder:
+    """A LatencyHistogram for every command name"""
+
+    def __init__(self):
+        self.histograms = {}
+
+    def record(self, name, seconds):
+        try:
+            hist = self.histograms[name]
+        except KeyError:
+            hist = self.histograms[name] = LatencyHistogram()
+        hist.record(seconds)
+
+    def clear(self):
+        self.histograms.clear()
+
+    def format(self, percentiles=PERCENTILES):
+        """Return a table of the percentiles in ms, the slowest p99 first"""
+        header = '{0:<24} {1:>7}'.format('command', 'count') + ''.join(
+            '{0:>9}'.format('p%d' % pct) for pct in percentiles) + '      max'
+        lines = [header]
+        rows = sorted(self.histograms.items(),
+                      key=lambda item: item[1].percentile(percentiles[-1]),
+                      reverse=True)
+        for name, hist in rows:
+            lines.append('{0:<24} {1:>7}'.format(name[:24], hist.count) + ''.join(
+                '{0:>9.2f}'.format(hist.percentile(pct) * 1000)
+                for pct in percentiles) + '{0:>9.2f}'.format(hist.max / 1000))
+        return '\n'.join(lines)
@@ -3,13 +3,56 @@
 """Interface for drawing images into the console
 
 This module provides functions to draw images in the terminal using supported
-implementations.
+implementations.  Implementations register themselves for a value of the
+preview_images_method setting with @register_image_displayer.
 """
 
+import base64
+import json
 import os
+import struct
+import sys
+import tempfile
+import threading
+import zlib
+from queue import Queue, Empty
+from subprocess import Popen, PIPE, DEVNULL
+from fcntl import ioctl
+from termios import TIOCGWINSZ
 
+from ..services.shared import SettingsAware, VideoManagerAware
+from .lru import LRUCache
 
-class ImgDisplayUnsupportedException(Exception):
+IMAGE_DISPLAYERS = {}
+
+HELPER_TIMEOUT = 1.0  # seconds to wait for the reply of a helper program
+W3MIMGDISPLAY_PATHS = (
+    '/usr/lib/w3m/w3mimgdisplay',
+    '/usr/libexec/w3m/w3mimgdisplay',
+    '/usr/lib64/w3m/w3mimgdisplay',
+    '/usr/libexec64/w3m/w3mimgdisplay',
+    '/usr/local/libexec/w3m/w3mimgdisplay',
+)
+KITTY_CACHE_SIZE = 32  # images kept uploaded to the terminal
+KITTY_CHUNK_SIZE = 4096  # base64 bytes per escape sequence when sent inline
+SIXEL_CACHE_SIZE = 64  # encoded images kept for redisplay
+SIXEL_LEVELS = 6  # levels per channel of the sixel palette, 6**3 registers
+SIXEL_MIN_RUN = 4  # shorter runs are cheaper to repeat than to count
+
+# 8x8 Bayer matrix, the thresholds of ordered dithering
+BAYER_8 = (
+    (0, 32, 8, 40, 2, 34, 10, 42),
+    (48, 16, 56, 24, 50, 18, 58, 26),
+    (12, 44, 4, 36, 14, 46, 6, 38),
+    (60, 28, 52, 20, 62, 30, 54, 22),
+    (3, 35, 11, 43, 1, 33, 9, 41),
+    (51, 19, 59, 27, 49, 17, 57, 25),
+    (15, 47, 7, 39, 13, 45, 5, 37),
+    (63, 31, 55, 23, 61, 29, 53, 21),
+)
+
+
+class ImgDisplayUnsupportedException(Exception, SettingsAware):
     def __init__(self, message=None):
         if message is None:
             message = (
@@ -19,6 +62,31 @@ class ImgDisplayUnsupportedException(Exception):
         super(ImgDisplayUnsupportedException, self).__init__(message)
 
 
+def register_image_displayer(method):
+    def decorator(cls):
+        IMAGE_DISPLAYERS[method] = cls
+        return cls
+
+    return decorator
+
+
+def get_image_displayer(method):
+    """Return a new displayer for a value of preview_images_method"""
+    return IMAGE_DISPLAYERS.get(method, ImageDisplayer)()
+
+
+def get_cell_size(fileno=None):
+    """Return the (width, height) of a terminal cell in pixels"""
+    if fileno is None:
+        fileno = sys.stdout.fileno()
+    rows, cols, xpixels, ypixels = struct.unpack(
+        'HHHH', ioctl(fileno, TIOCGWINSZ, struct.pack('HHHH', 0, 0, 0, 0)))
+    if not (rows and cols and xpixels and ypixels):
+        raise ImgDisplayUnsupportedException(
+            'The terminal does not report its size in pixels')
+    return xpixels // cols, ypixels // rows
+
+
 class ImageDisplayer:
     """Image display provider functions for drawing images in the terminal"""
 
@@ -32,3 +100,451 @@ class ImageDisplayer:
 
     def quit(self):
         """Cleanup and close"""
+
+
+def _write_at(start_x, start_y, data):
+    """Write data at a screen position and put the cursor back"""
+    out = sys.stdout.buffer
+    out.write(b'\x1b7\x1b[%d;%dH' % (start_y + 1, start_x + 1))
+    out.write(data)
+    out.write(b'\x1b8')
+    out.flush()
+
+
+def _load_image(path, max_width, max_height, keep_alpha=False):
+    """Return the image at path as RGB(A), scaled down to fit"""
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImgDisplayUnsupportedException(
+            'Image previews need the Pillow package')
+    with Image.open(path) as image:
+        image.draft('RGB', (max_width, max_height))  # cheap JPEG downscaling
+        alpha = keep_alpha and ('A' in image.getbands()
+                                or 'transparency' in image.info)
+        image = image.convert('RGBA' if alpha else 'RGB')
+    image.thumbnail((max_width, max_height))
+    return image
+
+
+def sixel_quantize(pixels, dithering='ordered'):
+    """Map RGB pixels to indices into the SIXEL_LEVELS**3 color cube
+
+    Ordered dithering offsets each pixel by its threshold in the Bayer
+    matrix before rounding down, which is one vectorized operation over
+    the whole image.
+
+    >>> import numpy
+    >>> pixels = numpy.array([[[0, 0, 0], [255, 255, 255], [255, 0, 0]]], 'uint8')
+    >>> sixel_quantize(pixels, 'none').tolist()
+    [[0, 215, 180]]
+    """
+    import numpy
+    steps = SIXEL_LEVELS - 1
+    scaled = pixels.astype(numpy.float32) * (steps / 255.0)
+    if dithering == 'ordered':
+        height, width = pixels.shape[:2]
+        bayer = (numpy.array(BAYER_8, numpy.float32) + 0.5) / 64
+        tiles = (height // 8 + 1, width // 8 + 1)
+        scaled += numpy.tile(bayer, tiles)[:height, :width, None]
+    else:
+        scaled += 0.5
+    levels = numpy.clip(scaled, 0, steps).astype(numpy.uint16)
+    return ((levels[..., 0] * SIXEL_LEVELS + levels[..., 1]) * SIXEL_LEVELS
+            + levels[..., 2])
+
+
+def _sixel_palette(used):
+    steps = SIXEL_LEVELS - 1
+    out = []
+    for index in used.tolist():
+        red, rest = divmod(index, SIXEL_LEVELS * SIXEL_LEVELS)
+        green, blue = divmod(rest, SIXEL_LEVELS)
+        out.append('#%d;2;%d;%d;%d' % (index, red * 100 // steps,
+                                       green * 100 // steps, blue * 100 // steps))
+    return ''.join(out).encode('ascii')
+
+
+def _compress_runs(data):
+    """Replace runs of the same sixel character by "!<count><char>"
+
+    The runs are found with numpy, so only the long runs cost a step of
+    the Python loop.  Sixel characters are '?' to '~'; the digits and
+    punctuation of the color and band commands are below that range.
+    """
+    import numpy
+    chars = numpy.frombuffer(data, numpy.uint8)
+    starts = numpy.flatnonzero(chars[1:] != chars[:-1]) + 1
+    starts = numpy.concatenate(([0], starts))
+    lengths = numpy.diff(numpy.append(starts, len(chars)))
+    long_runs = (lengths >= SIXEL_MIN_RUN) & (chars[starts] >= 63) & (chars[starts] <= 126)
+    out = []
+    pos = 0
+    for start, length in zip(starts[long_runs].tolist(), lengths[long_runs].tolist()):
+        out.append(data[pos:start])
+        out.append(b'!%d%c' % (length, data[start]))
+        pos = start + length
+    out.append(data[pos:])
+    return b''.join(out)
+
+
+def sixel_encode(indices):
+    """Encode an array of palette indices as a sixel escape sequence
+
+    A sixel row holds the pixels of one color in a band of six rows.  The
+    rows of all bands are built at once: the pixels of the nth row of
+    every band add their bit to their (band, color) row in one vectorized
+    step, n = 0..5.  Runs of the same character are compressed in one pass
+    at the end.
+
+    >>> import numpy
+    >>> sixel_encode(numpy.zeros((2, 5), 'uint16'))
+    b'\\x1bPq"1;1;5;2#0;2;0;0;0#0!5B\\x1b\\\\'
+    """
+    import numpy
+    height, width = indices.shape
+    colors = SIXEL_LEVELS ** 3
+    bands = numpy.arange(height)[:, None] // 6 * colors
+    pairs = bands + indices
+    used = numpy.flatnonzero(numpy.bincount(pairs.ravel()))
+    row_of_pair = numpy.zeros(used[-1] + 1, numpy.intp)
+    row_of_pair[used] = numpy.arange(len(used))
+    targets = row_of_pair[pairs] * width + numpy.arange(width)
+    sixels = numpy.full(len(used) * width, 63, numpy.uint8)
+    for bit in range(6):
+        sixels[targets[bit::6]] += 1 << bit  # no target twice in one step
+    sixels = sixels.reshape(len(used), width)
+    ends = (width - numpy.argmax(sixels[:, ::-1] != 63, axis=1)).tolist()
+    data = sixels.tobytes()
+
+    out = [b'\x1bPq"1;1;%d;%d' % (width, height),
+           _sixel_palette(numpy.flatnonzero(numpy.bincount(indices.ravel())))]
+    last_band = 0
+    offset = 0
+    for pair, end in zip(used.tolist(), ends):
+        band, color = divmod(pair, colors)
+        if band != last_band:
+            out.append(b'-')
+            last_band = band
+        elif offset:
+            out.append(b'$')
+        out.append(b'#%d' % color)
+        out.append(data[offset:offset + end])
+        offset += width
+    out.append(b'\x1b\\')
+    return _compress_runs(b''.join(out))
+
+
+@register_image_displayer('sixel')
+class SixelImageDisplayer(ImageDisplayer, SettingsAware, VideoManagerAware):
+    """Draws images as sixel graphics
+
+    The encoded escape sequences are kept in an LRU cache keyed by the
+    image, its modification time, the cell geometry and the dithering, so
+    showing a thumbnail again only writes the cached bytes.
+    """
+
+    def __init__(self):
+        self.cache = LRUCache(SIXEL_CACHE_SIZE)
+
+    def _encoded(self, path, width, height):
+        cell_width, cell_height = get_cell_size()
+        dithering = self.settings.sixel_dithering
+        key = (path, os.stat(path).st_mtime_ns, cell_width, cell_height,
+               width, height, dithering)
+        encoded = self.cache.get(key)
+        if encoded is None:
+            # Whole bands only, so the last band does not scroll the screen
+            max_height = height * cell_height // 6 * 6
+            try:
+                import numpy
+            except ImportError:
+                raise ImgDisplayUnsupportedException(
+                    'Sixel previews need the numpy package')
+            pixels = numpy.asarray(
+                _load_image(path, width * cell_width, max_height))
+            encoded = sixel_encode(sixel_quantize(pixels, dithering))
+            self.cache[key] = encoded
+        return encoded
+
+    def draw(self, path, start_x, start_y, width, height):
+        _write_at(start_x, start_y, self._encoded(path, width, height))
+
+    def clear(self, start_x, start_y, width, height):
+        # Sixel pixels stay until the text below them is written again
+        self.app.ui.win.redrawln(start_y, height)
+
+    def quit(self):
+        self.cache.clear()
+
+
+def kitty_command(payload=b'', **keys):
+    """Return an escape sequence of the kitty graphics protocol
+
+    >>> kitty_command(a='p', i=7, q=2)
+    b'\\x1b_Ga=p,i=7,q=2\\x1b\\\\'
+    >>> kitty_command(b'L3RtcC9h', a='T', t='t')
+    b'\\x1b_Ga=T,t=t;L3RtcC9h\\x1b\\\\'
+    """
+    control = ','.join('%s=%s' % item for item in keys.items()).encode('ascii')
+    if payload:
+        control += b';' + payload
+    return b'\x1b_G' + control + b'\x1b\\'
+
+
+@register_image_displayer('kitty')
+class KittyImageDisplayer(ImageDisplayer):
+    """Draws images with the kitty graphics protocol
+
+    The decoded pixels are handed to the terminal in shared memory (t=s)
+    or in a temporary file (t=t), so only a short escape sequence goes
+    through the tty.  Over ssh the terminal can see neither, and the
+    pixels are sent inline, compressed.  Every image stays uploaded under
+    its id while it is in the cache; showing it again or elsewhere only
+    places it.
+    """
+
+    def __init__(self):
+        self.cache = LRUCache(KITTY_CACHE_SIZE, on_evict=self._free)
+        # Ids are shared by everything running in the terminal window
+        self._next_id = (os.getpid() & 0xffff) << 12 | 1
+        self._placed = None
+        if os.environ.get('SSH_CONNECTION'):
+            self._transmit = self._transmit_inline
+        else:
+            try:
+                from multiprocessing import shared_memory  # noqa: F401
+            except ImportError:
+                self._transmit = self._transmit_file
+            else:
+                self._transmit = self._transmit_shared_memory
+
+    @staticmethod
+    def _transmit_shared_memory(data, keys):
+        from multiprocessing import resource_tracker, shared_memory
+        memory = shared_memory.SharedMemory(create=True, size=len(data))
+        try:
+            memory.buf[:len(data)] = data
+        finally:
+            memory.close()
+        # The terminal unlinks the memory once it has read it
+        resource_tracker.unregister(memory._name, 'shared_memory')
+        return kitty_command(base64.standard_b64encode(memory.name.encode()),
+                             **keys, t='s', S=len(data))
+
+    @staticmethod
+    def _transmit_file(data, keys):
+        # The terminal deletes the file once it has read it
+        fd, path = tempfile.mkstemp(prefix='ycp-', suffix='-tty-graphics-protocol')
+        with os.fdopen(fd, 'wb') as fobj:
+            fobj.write(data)
+        return kitty_command(base64.standard_b64encode(path.encode()),
+                             **keys, t='t', S=len(data))
+
+    @staticmethod
+    def _transmit_inline(data, keys):
+        payload = base64.standard_b64encode(zlib.compress(data))
+        chunks = [payload[i:i + KITTY_CHUNK_SIZE]
+                  for i in range(0, len(payload), KITTY_CHUNK_SIZE)]
+        out = [kitty_command(chunks[0], **keys, t='d', o='z', m=int(len(chunks) > 1))]
+        out.extend(kitty_command(chunk, m=int(i < len(chunks) - 1))
+                   for i, chunk in enumerate(chunks[1:], 1))
+        return b''.join(out)
+
+    def _upload(self, path, max_width, max_height):
+        image = _load_image(path, max_width, max_height, keep_alpha=True)
+        image_id = self._next_id
+        self._next_id += 1
+        keys = dict(a='t', f=32 if image.mode == 'RGBA' else 24,
+                    s=image.width, v=image.height, i=image_id, q=2)
+        sys.stdout.buffer.write(self._transmit(image.tobytes(), keys))
+        return image_id
+
+    def _free(self, _key, image_id):
+        if image_id == self._placed:
+            self._placed = None
+        sys.stdout.buffer.write(kitty_command(a='d', d='I', i=image_id, q=2))
+        sys.stdout.buffer.flush()
+
+    def draw(self, path, start_x, start_y, width, height):
+        cell_width, cell_height = get_cell_size()
+        key = (path, os.stat(path).st_mtime_ns,
+               width * cell_width, height * cell_height)
+        image_id = self.cache.get(key)
+        if image_id is None:
+            image_id = self._upload(path, width * cell_width, height * cell_height)
+            self.cache[key] = image_id
+        if self._placed not in (None, image_id):
+            self.clear(start_x, start_y, width, height)
+        # Placing an image again under the same placement id moves it
+        _write_at(start_x, start_y, kitty_command(a='p', i=image_id, p=1, C=1, q=2))
+        self._placed = image_id
+
+    def clear(self, start_x, start_y, width, height):
+        if self._placed is not None:
+            sys.stdout.buffer.write(kitty_command(a='d', d='i', i=self._placed, q=2))
+            sys.stdout.buffer.flush()
+            self._placed = None
+
+    def quit(self):
+        self.clear(0, 0, 0, 0)
+        self.cache.resize(0)  # frees every uploaded image
+        self.cache.resize(KITTY_CACHE_SIZE)
+
+
+class HelperProcess:
+    """A long-lived helper program that reads commands from its stdin
+
+    Commands are written without waiting for the program, so a clear and
+    the following draw travel together.  Its output is read by a thread,
+    which keeps the pipe from filling up; ask() skips the replies to the
+    commands before its own, including replies that came too late for an
+    earlier ask().  If the program died, it is started again on the next
+    command.
+
+    >>> helper = HelperProcess(['cat'])
+    >>> helper.ask('hello')
+    'hello'
+    >>> helper.process.kill()
+    >>> _ = helper.process.wait()
+    >>> helper.ask('again'), helper.restarts
+    ('again', 1)
+    >>> helper.stop()
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.process = None
+        self.restarts = -1
+        self._replies = Queue()
+        self._pending = 0
+
+    def _start(self):
+        try:
+            self.process = Popen(self.args, stdin=PIPE, stdout=PIPE, stderr=DEVNULL,
+                                 universal_newlines=True, bufsize=1)
+        except OSError as ex:
+            raise ImgDisplayUnsupportedException(
+                'Cannot run {0}: {1}'.format(self.args[0], ex))
+        self.restarts += 1
+        self._replies = Queue()
+        self._pending = 0
+        threading.Thread(target=self._read, args=(self.process.stdout, self._replies),
+                         name='ycp-image-helper', daemon=True).start()
+
+    @staticmethod
+    def _read(stdout, replies):
+        for line in stdout:
+            replies.put(line.rstrip('\n'))
+        stdout.close()
+
+    def send(self, *lines, replies=0):
+        """Write command lines, without waiting for the helper
+
+        replies is the number of lines the helper will answer with; they
+        are skipped by the next ask().
+        """
+        data = ''.join(line + '\n' for line in lines)
+        for _ in range(2):
+            if self.process is None or self.process.poll() is not None:
+                self._start()
+            try:
+                self.process.stdin.write(data)
+                self.process.stdin.flush()
+                self._pending += replies
+                return
+            except (BrokenPipeError, ValueError):  # died since the poll
+                self.process = None
+        raise ImgDisplayUnsupportedException(
+            '{0} keeps crashing'.format(self.args[0]))
+
+    def ask(self, *lines):
+        """Send lines and return the line answering them, None on timeout"""
+        for _ in range(2):
+            self.send(*lines, replies=1)
+            try:
+                while True:
+                    reply = self._replies.get(timeout=HELPER_TIMEOUT)
+                    self._pending -= 1
+                    if not self._pending:
+                        return reply
+            except Empty:
+                if self.process.poll() is None:
+                    # The late reply stays pending, the next ask() skips it
+                    return None
+                # It died with the command in the pipe, try a new one
+        return None
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+
+@register_image_displayer('w3m')
+class W3MImageDisplayer(ImageDisplayer):
+    """Draws images with w3mimgdisplay, which is started only once"""
+
+    def __init__(self):
+        path = os.environ.get('W3MIMGDISPLAY_PATH')
+        if not path:
+            path = next((p for p in W3MIMGDISPLAY_PATHS if os.access(p, os.X_OK)),
+                        'w3mimgdisplay')
+        self.helper = HelperProcess([path])
+
+    def draw(self, path, start_x, start_y, width, height):
+        cell_width, cell_height = get_cell_size()
+        max_width, max_height = width * cell_width, height * cell_height
+        size = self.helper.ask('5;' + path)
+        try:
+            image_width, image_height = (int(n) for n in size.split())
+        except (AttributeError, ValueError):
+            raise ImgDisplayUnsupportedException(
+                'w3mimgdisplay cannot read ' + path)
+        if not image_width or not image_height:
+            raise ImgDisplayUnsupportedException('w3mimgdisplay cannot read ' + path)
+        scale = min(1.0, max_width / image_width, max_height / image_height)
+        self.helper.send('0;1;{0};{1};{2};{3};;;;;{4}'.format(
+            start_x * cell_width, start_y * cell_height,
+            int(image_width * scale), int(image_height * scale), path),
+            '4;', '3;', replies=1)
+
+    def clear(self, start_x, start_y, width, height):
+        if self.helper.process is None:
+            return
+        cell_width, cell_height = get_cell_size()
+        self.helper.send('6;{0};{1};{2};{3}'.format(
+            start_x * cell_width, start_y * cell_height,
+            width * cell_width, height * cell_height), '4;', '3;', replies=1)
+
+    def quit(self):
+        self.helper.stop()
+
+
+@register_image_displayer('ueberzug')
+class UeberzugImageDisplayer(ImageDisplayer):
+    """Draws images with an ueberzug layer, which is started only once"""
+
+    IDENTIFIER = 'ycp-preview'
+
+    def __init__(self):
+        self.helper = HelperProcess(['ueberzug', 'layer', '--silent'])
+
+    def draw(self, path, start_x, start_y, width, height):
+        self.helper.send(json.dumps({
+            'action': 'add', 'identifier': self.IDENTIFIER, 'path': path,
+            'x': start_x, 'y': start_y, 'max_width': width, 'max_height': height,
+        }))
+
+    def clear(self, start_x, start_y, width, height):
+        if self.helper.process is not None:
+            self.helper.send(json.dumps({'action': 'remove',
+                                         'identifier': self.IDENTIFIER}))
+
+    def quit(self):
+        self.helper.stop()
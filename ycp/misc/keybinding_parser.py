@@ -2,6 +2,7 @@
 
 # import copy
 import curses.ascii
+from itertools import groupby
 # from .. import PY3
 
 digits = set(range(ord('0'), ord('9') + 1))
@@ -157,6 +158,101 @@ def _unbind_traverse(pointer, keys, pos=0):
             pass
 
 
+class CompiledKeymap:
+    """A key layout compiled into a flat transition table
+
+    Every node of the nested layout dicts becomes an int state; 0 is the
+    root.  transitions maps (state, key) to the next state, anykey maps a
+    state to the state of its <any> binding, actions holds the commands of
+    the leaves and passive the <bg> commands of inner nodes.  States are
+    numbered depth first, so the states below state s are s + 1 up to
+    end[s], which makes collecting the hints of a prefix a slice.
+
+    >>> keymap = CompiledKeymap({ord('g'): {ord('g'): 'move to=0',
+    ...                                     ANYKEY: 'cd %any'}})
+    >>> state = keymap.transitions[0, ord('g')]
+    >>> keymap.actions[keymap.transitions[state, ord('g')]]
+    'move to=0'
+    >>> keymap.hints(state, collapse_threshold=10)
+    [('<any>', 'cd %any'), ('g', 'move to=0')]
+    """
+
+    ROOT = 0
+
+    def __init__(self, layout):
+        self.transitions = {}
+        self.anykey = {}
+        self.actions = {}
+        self.passive = {}
+        self.prefixes = ['']
+        self.end = [0]
+        self.allow_quantifiers = layout.get(QUANT_KEY) != 'false'
+        self._hints = {}
+        self._compile(layout, self.ROOT)
+
+    def _compile(self, node, state):
+        for key, value in node.items():
+            if key == PASSIVE_ACTION:
+                self.passive[state] = value
+                continue
+            if key == QUANT_KEY:
+                continue
+            child = len(self.prefixes)
+            self.prefixes.append(self.prefixes[state] + key_to_string(key))
+            self.end.append(child + 1)
+            if key == ANYKEY:
+                self.anykey[state] = child
+            else:
+                self.transitions[state, key] = child
+            if isinstance(value, dict):
+                self._compile(value, child)
+            else:
+                self.actions[child] = value
+        self.end[state] = len(self.prefixes)
+
+    def hints(self, state, collapse_threshold):
+        """The sorted (keys, command) hints below state, computed once"""
+        try:
+            return self._hints[state, collapse_threshold]
+        except KeyError:
+            pass
+        skip = len(self.prefixes[state])
+        hints = []
+        for child in range(state + 1, self.end[state]):
+            text = self.actions.get(child)
+            if text is None or text.startswith('hint') or text.startswith('chain hint'):
+                continue
+            hints.append((self.prefixes[child][skip:], text))
+        hints = sort_hints(hints, collapse_threshold)
+        self._hints[state, collapse_threshold] = hints
+        return hints
+
+
+def sort_hints(hints, collapse_threshold):
+    """Sort the hints by the action string but first group them by the
+    first key.  If there are more than collapse_threshold hints, groups
+    are collapsed to "...".
+    """
+    # groupby needs the list to be sorted.
+    hints = sorted(hints, key=lambda t: t[0])
+    grouped_hints = (sorted(group, key=lambda hint: hint[1])
+                     for _, group in groupby(hints, key=lambda hint: hint[0][0]))
+
+    # If there are too many hints, collapse the sublists.
+    if len(hints) > collapse_threshold:
+        grouped_hints = (
+            [(hint_group[0][0][0], "...")] if len(hint_group) > 1 else hint_group
+            for hint_group in grouped_hints
+        )
+
+    # Sort by the first action in group.
+    grouped_hints = sorted(grouped_hints, key=lambda g: g[0][1])
+    return [item for inner_list in grouped_hints for item in inner_list]
+
+
+EMPTY_KEYMAP = CompiledKeymap({})
+
+
 class KeyBuffer:
 
     def __init__(self, keymap=None):
@@ -169,7 +265,7 @@ class KeyBuffer:
 
         self.keys = []
         self.wildcards = []
-        self.keymap = keymap  # FIXME: Naming
+        self.keymap = keymap or EMPTY_KEYMAP  # FIXME: Naming
         self.clear()
 
     def add(self, key):
@@ -182,56 +278,67 @@ class KeyBuffer:
         else:
             self.finished_parsing_quantifier = True
 
-            moved = True
-            if key in self.pointer:
-                self.pointer = self.pointer[key]
-            elif ANYKEY in self.pointer and \
-                    key not in EXCLUDE_FROM_ANYKEY:
-                self.wildcards.append(key)
-                self.pointer = self.pointer[ANYKEY]
-            else:
-                moved = False
-
-            if moved:
-                if isinstance(self.pointer, dict):
-                    if PASSIVE_ACTION in self.pointer:
-                        self.result = self.pointer[PASSIVE_ACTION]
-                else:
-                    self.result = self.pointer
+            keymap = self.keymap
+            state = keymap.transitions.get((self.pointer, key))
+            if state is None and key not in EXCLUDE_FROM_ANYKEY:
+                state = keymap.anykey.get(self.pointer)
+                if state is not None:
+                    self.wildcards.append(key)
+
+            if state is not None:
+                self.pointer = state
+                if state in keymap.actions:
+                    self.result = keymap.actions[state]
                     self.finished_parsing = True
+                else:
+                    self.result = keymap.passive.get(state)
             else:
                 self.finished_parsing = True
                 self.parse_error = True
 
+    def hints(self, collapse_threshold):
+        """The hints for the keys typed so far"""
+        return self.keymap.hints(self.pointer, collapse_threshold)
+
     def clear(self):
         self.keys = []  # FIXME: Statement declaration
         self.wildcards = []
-        self.pointer = self.keymap
+        self.pointer = CompiledKeymap.ROOT
         self.result = None
         self.quantifier = None
-        self.finished_parsing_quantifier = False
+        self.finished_parsing_quantifier = not self.keymap.allow_quantifiers
         self.finished_parsing = False
         self.parse_error = False
 
-        if self.keymap and QUANT_KEY in self.keymap:
-            if self.keymap[QUANT_KEY] == 'false':
-                self.finished_parsing_quantifier = True
-
     def __str__(self):
         return "".join(key_to_string(c) for c in self.keys)
 
 
 class KeyLayout(dict):
+    """The key bindings of every context, as nested dicts
+
+    Each context is compiled into a CompiledKeymap when it is first used
+    after a change; bind() and unbind() drop the compiled table.
+    """
 
     def __init__(self, keybuffer=None):
         super().__init__()
         self.keybuffer = keybuffer
         self.used_keylayout = None
+        self._compiled = {}
+
+    def compiled(self, context):
+        try:
+            return self._compiled[context]
+        except KeyError:
+            keymap = self._compiled[context] = CompiledKeymap(self.get(context, {}))
+            return keymap
 
     def use_layout(self, keylayout_name):
-        self.keybuffer.keylayout = self.get(keylayout_name, {})
-        if self.used_keylayout != keylayout_name:
+        keymap = self.compiled(keylayout_name)
+        if self.used_keylayout != keylayout_name or self.keybuffer.keymap is not keymap:
             self.used_keylayout = keylayout_name
+            self.keybuffer.keymap = keymap
             self.keybuffer.clear()
 
     def _clean_input(self, context, keys):
@@ -239,8 +346,8 @@ class KeyLayout(dict):
             pointer = self[context]
         except KeyError:
             self[context] = pointer = {}
-        if PY3:
-            keys = keys.encode('utf-8').decode('latin-1')
+        self._compiled.pop(context, None)
+        keys = keys.encode('utf-8').decode('latin-1')
         return list(parse_keybinding(keys)), pointer
 
     def bind(self, context, keys, leaf):
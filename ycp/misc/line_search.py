@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""Search the lines of a long text for a regular expression.
+
+The lines are scanned in a background thread, a chunk at a time, while
+the UI keeps running.  The numbers of the matching lines are kept in a
+sorted array and the spans of the matches in a dict, so that jumping to
+the next match is a binary search and highlighting a visible line is a
+dict lookup.  Lines that are still being read (a stream or a file that
+is being indexed) are scanned as they come in; wait_for_lines() asks for
+them and blocks the search thread until they are there.
+"""
+
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from time import sleep
+
+SEARCH_CHUNK = 2000  # lines scanned between two updates
+POLL_INTERVAL = 0.1  # seconds to wait for more lines of an unfinished text
+
+
+class LineSearch:
+    """Finds regex in lines[i] for every i, in the background
+
+    get_text(line) returns the text to search in, is_complete() whether
+    no more lines will be added, and on_update() is called when new
+    matches were found or the search finished.  wait_for_lines(count)
+    blocks until there are count lines or no more will come; without it,
+    an unfinished text is polled.
+
+    >>> import re
+    >>> search = LineSearch(['foo', 'bar', 'a foo foo'], re.compile('fo+'))
+    >>> search.wait()
+    >>> list(search.match_lines), search.spans[2]
+    ([0, 2], [(2, 5), (6, 9)])
+    >>> search.next_match(0), search.next_match(2), search.next_match(0, forward=False)
+    (2, 0, 2)
+
+    A stream is read as far as the search needs it:
+
+    >>> import io
+    >>> from .stream_reader import StreamReader
+    >>> lines = []
+    >>> reader = StreamReader(io.StringIO('x\\n' * 50 + 'foo\\n'), lines, read_ahead=10)
+    >>> search = LineSearch(lines, re.compile('fo+'), is_complete=lambda: reader.finished,
+    ...                     wait_for_lines=reader.wait_for)
+    >>> search.wait()
+    >>> list(search.match_lines)
+    [50]
+    """
+
+    def __init__(self, lines, regex, get_text=str, is_complete=None,
+                 on_update=None, wait_for_lines=None):
+        self.lines = lines
+        self.regex = regex
+        self.get_text = get_text
+        self.is_complete = is_complete or (lambda: True)
+        self.on_update = on_update
+        self.wait_for_lines = wait_for_lines
+        self.match_lines = array('Q')
+        self.spans = {}
+        self.scanned = 0
+        self.finished = False
+        self._stopped = False
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ycp-line-search',
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        lines = self.lines
+        finditer = self.regex.finditer
+        try:
+            while not self._stopped:
+                start = self.scanned
+                end = min(len(lines), start + SEARCH_CHUNK)
+                if start >= end:
+                    if self.is_complete() and start >= len(lines):
+                        break
+                    if self.wait_for_lines is not None:
+                        self.wait_for_lines(start + 1)
+                    else:
+                        sleep(POLL_INTERVAL)
+                    continue
+                found = False
+                for i in range(start, end):
+                    spans = [match.span() for match in finditer(self.get_text(lines[i]))
+                             if match.end() > match.start()]
+                    if spans:
+                        self.spans[i] = spans
+                        self.match_lines.append(i)
+                        found = True
+                self.scanned = end
+                if found and self.on_update is not None:
+                    self.on_update()
+                sleep(0)  # let the UI thread have the GIL
+        except (IndexError, ValueError):
+            pass  # the lines were replaced or their map closed under our feet
+        finally:
+            self.finished = True
+            self._done.set()
+            if self.on_update is not None:
+                self.on_update()
+
+    def wait(self):
+        """Block until the search is finished"""
+        self._done.wait()
+
+    def stop(self):
+        self._stopped = True
+
+    def next_match(self, line, forward=True):
+        """Return the first matching line after (or before) line.
+
+        Wraps around once the whole text was searched; returns None if
+        there is no such line (yet).
+        """
+        lines = self.match_lines
+        if forward:
+            i = bisect_right(lines, line)
+            if i < len(lines):
+                return lines[i]
+            wrapped = lines[0] if lines else None
+        else:
+            i = bisect_left(lines, line)
+            if i > 0:
+                return lines[i - 1]
+            wrapped = lines[-1] if lines else None
+        if self.finished and wrapped != line:
+            return wrapped
+        return None
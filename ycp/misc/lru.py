@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""A dict with a maximum size that drops the least recently used entries"""
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Mapping that holds at most maxsize entries
+
+    >>> cache = LRUCache(2)
+    >>> cache['a'] = 1
+    >>> cache['b'] = 2
+    >>> cache.get('a')
+    1
+    >>> cache['c'] = 3
+    >>> 'b' in cache, 'a' in cache, len(cache)
+    (False, True, 2)
+
+    on_evict(key, value) is called for every entry that is dropped to
+    make room.
+    """
+
+    def __init__(self, maxsize, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, key):
+        value = self._data[key]
+        self._data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        data = self._data
+        data[key] = value
+        data.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        data = self._data
+        while len(data) > self.maxsize:
+            key, value = data.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def resize(self, maxsize):
+        """Change maxsize, dropping the oldest entries if needed"""
+        self.maxsize = maxsize
+        self._evict()
+
+    def clear(self):
+        self._data.clear()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""Random access to the lines of a very large file.
+
+The file is memory mapped and a background thread records the offset of
+every line in an array of 8-byte integers, so memory use grows with the
+number of lines, not with their length.  Only the lines that are asked
+for are decoded.  Negative indices are resolved by scanning backwards
+from the end of the file, so the last lines can be shown before the
+index is complete.
+"""
+
+import mmap
+import threading
+from array import array
+
+INDEX_CHUNK_SIZE = 1 << 20  # bytes scanned between two index updates
+
+
+class MappedLines:
+    """A read-only sequence of the lines of a file, without line endings
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryFile() as fobj:
+    ...     _ = fobj.write(b'one\\ntwo\\nthree')
+    ...     fobj.flush()
+    ...     lines = MappedLines(fobj)
+    ...     lines.wait()
+    ...     print(len(lines), lines[1], lines[-1], lines.max_length)
+    ...     print(lines.tail(2), lines.tail(5))
+    ...     lines.close()
+    3 two three 5
+    ['two', 'three'] ['one', 'two', 'three']
+    """
+
+    def __init__(self, fobj, encoding='utf-8'):
+        self.encoding = encoding
+        self.max_length = 0
+        self._offsets = array('Q', [0])
+        self._cond = threading.Condition()
+        self._complete = False
+        self._closed = False
+        try:
+            self._map = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self._map = b''
+        self._size = len(self._map)
+        if not self._size:
+            self._offsets = array('Q')
+            self._complete = True
+            return
+        self._thread = threading.Thread(target=self._build_index,
+                                        name='ycp-line-index', daemon=True)
+        self._thread.start()
+
+    def _build_index(self):
+        data = self._map
+        size = self._size
+        pos = line_start = 0
+        while pos < size and not self._closed:
+            chunk_end = min(size, pos + INDEX_CHUNK_SIZE)
+            found = []
+            longest = 0
+            while True:
+                newline = data.find(b'\n', pos, chunk_end)
+                if newline < 0:
+                    break
+                longest = max(longest, newline - line_start)
+                pos = line_start = newline + 1
+                found.append(pos)
+            pos = chunk_end
+            if pos == size:
+                longest = max(longest, size - line_start)
+            with self._cond:
+                if found and found[-1] == size:
+                    found.pop()  # no empty line after a final newline
+                self._offsets.extend(found)
+                self.max_length = max(self.max_length, longest)
+                self._cond.notify_all()
+        with self._cond:
+            self._complete = True
+            self._cond.notify_all()
+
+    @property
+    def complete(self):
+        """Whether every line has been indexed"""
+        return self._complete
+
+    def wait(self, count=None):
+        """Block until count lines (or all of them) are indexed"""
+        with self._cond:
+            while not self._complete and (count is None
+                                          or len(self._offsets) < count):
+                self._cond.wait()
+
+    def __len__(self):
+        """The number of lines indexed so far"""
+        return len(self._offsets)
+
+    def __iter__(self):
+        i = 0
+        while True:
+            try:
+                yield self[i]
+            except IndexError:
+                return
+            i += 1
+
+    def _decode(self, start, end):
+        if end > start and self._map[end - 1:end] == b'\n':
+            end -= 1
+        if end > start and self._map[end - 1:end] == b'\r':
+            end -= 1
+        return self._map[start:end].decode(self.encoding, 'replace')
+
+    def __getitem__(self, n):
+        if self._closed:
+            raise IndexError(n)
+        if n < 0:
+            return self._from_end(-n)
+        self.wait(n + 2)
+        offsets = self._offsets
+        if n >= len(offsets):
+            raise IndexError(n)
+        end = offsets[n + 1] if n + 1 < len(offsets) else self._size
+        return self._decode(offsets[n], end)
+
+    def _from_end(self, n):
+        """Return the nth line from the end, without the index"""
+        lines = self.tail(n)
+        if len(lines) < n:
+            raise IndexError(-n)
+        return lines[0]
+
+    def tail(self, n):
+        """Return the last n lines, or all of a shorter file.
+
+        The file is scanned backwards from its end, so this does not wait
+        for the index.
+        """
+        data = self._map
+        end = self._size
+        lines = []
+        if self._closed or not end:
+            return lines
+        if data[end - 1:end] == b'\n':
+            end -= 1
+        while end >= 0 and len(lines) < n:
+            start = data.rfind(b'\n', 0, end) + 1
+            lines.append(self._decode(start, end))
+            end = start - 1
+        lines.reverse()
+        return lines
+
+    def close(self):
+        self._closed = True
+        if self._size:
+            self._thread.join()
+            self._map.close()
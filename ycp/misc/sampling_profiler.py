@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""A low-overhead statistical profiler that runs inside ycp.
+
+Unlike cProfile, which hooks every function call, the sampler wakes up a
+fixed number of times per second, reads the current stack of every other
+thread from sys._current_frames() and counts it.  It is cheap enough to
+be switched on in a live session that feels sluggish.
+
+The samples can be written in the "collapsed stack" format understood by
+flamegraph.pl and most flame graph tools, or as a speedscope JSON file.
+"""
+
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from itertools import count
+from time import strftime, perf_counter
+
+DEFAULT_FREQUENCY = 100  # samples per second
+FORMATS = {
+    'speedscope': '.speedscope.json',
+    'collapsed': '.collapsed.txt',
+}
+
+
+def _frame_label(code):
+    return '{0} ({1}:{2})'.format(code.co_name, code.co_filename, code.co_firstlineno)
+
+
+class SamplingProfiler:
+
+    def __init__(self, frequency=None):
+        self.frequency = max(1, frequency or DEFAULT_FREQUENCY)
+        self.samples = Counter()
+        self.duration = 0.0
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start sampling in a background thread, dropping old samples."""
+        if self.running:
+            return
+        self.samples.clear()
+        self.duration = 0.0
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='ycp-profiler',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        interval = 1.0 / self.frequency
+        own_ident = threading.get_ident()
+        samples = self.samples
+        start = perf_counter()
+        while not self._stop_event.wait(interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                samples[tuple(stack)] += 1
+        self.duration = perf_counter() - start
+
+    def write_collapsed(self, fobj):
+        for stack, count in self.samples.most_common():
+            fobj.write(';'.join(_frame_label(code) for code in stack))
+            fobj.write(' %d\n' % count)
+
+    def write_speedscope(self, fobj):
+        frames = []
+        frame_index = {}
+        samples = []
+        weights = []
+        interval = 1.0 / self.frequency
+        for stack, count in self.samples.items():
+            indices = []
+            for code in stack:
+                if code not in frame_index:
+                    frame_index[code] = len(frames)
+                    frames.append({'name': code.co_name,
+                                   'file': code.co_filename,
+                                   'line': code.co_firstlineno})
+                indices.append(frame_index[code])
+            samples.append(indices)
+            weights.append(count * interval)
+        json.dump({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'exporter': 'ycp',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': 'ycp',
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }, fobj)
+
+    def save(self, directory, fmt='speedscope'):
+        """Write the samples to a new file in directory, return its path."""
+        if fmt not in FORMATS:
+            raise ValueError("Unknown profile format `%s', use one of: %s"
+                             % (fmt, ', '.join(FORMATS)))
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(directory, 'profile-{0}-{1}'.format(
+            strftime('%Y%m%d-%H%M%S'), os.getpid()))
+        # Profiles saved within the same second get a number
+        for number in count():
+            path = stem + ('-%d' % number if number else '') + FORMATS[fmt]
+            try:
+                fobj = open(path, 'x', encoding='utf-8')
+            except FileExistsError:
+                continue
+            break
+        with fobj:
+            if fmt == 'speedscope':
+                self.write_speedscope(fobj)
+            else:
+                self.write_collapsed(fobj)
+        return path
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+"""Timings of the startup phases, printed with --startup-report"""
+
+from time import perf_counter
+
+
+class StartupReport:
+    """Records how long each phase of the startup took.
+
+    Call mark(name) at the end of every phase; the phase is timed from
+    the previous mark (or from start).
+
+    >>> report = StartupReport(start=0.0)
+    >>> report.phases.append(('imports', 0.0123))
+    >>> print(report.format())
+    imports                 12.3 ms
+    total                   12.3 ms
+    """
+
+    def __init__(self, start=None):
+        self.start = perf_counter() if start is None else start
+        self.last = self.start
+        self.phases = []
+
+    def mark(self, name):
+        now = perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def format(self):
+        lines = ['{0:<20} {1:7.1f} ms'.format(name, duration * 1000)
+                 for name, duration in self.phases]
+        total = sum(duration for _, duration in self.phases)
+        lines.append('{0:<20} {1:7.1f} ms'.format('total', total * 1000))
+        return '\n'.join(lines)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""Read the lines of a stream in a background thread.
+
+The reader appends to a list that the UI thread reads from.  It stays
+read_ahead lines ahead of the last line that was requested and then
+waits, so a stream is only read as far as somebody looks at it.  The UI
+thread never blocks on a slow stream.
+"""
+
+import threading
+
+READ_AHEAD = 1000
+
+
+class StreamReader:
+    """Fills lines from stream, calling on_update() after each new line
+
+    >>> import io
+    >>> lines = []
+    >>> reader = StreamReader(io.StringIO('a\\nb\\nc\\n'), lines, read_ahead=2)
+    >>> reader.wait()
+    >>> lines
+    ['a\\n', 'b\\n']
+    >>> reader.request(3)
+    >>> reader.wait()
+    >>> lines, reader.finished
+    (['a\\n', 'b\\n', 'c\\n'], True)
+    """
+
+    def __init__(self, stream, lines, on_update=None, read_ahead=READ_AHEAD):
+        self.stream = stream
+        self.lines = lines
+        self.on_update = on_update
+        self.read_ahead = read_ahead
+        self.max_length = 0
+        self.finished = False
+        self._wanted = 0
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='ycp-stream-reader',
+                                        daemon=True)
+        self._thread.start()
+
+    def _want_more(self):
+        return not self._stopped and len(self.lines) < self._wanted + self.read_ahead
+
+    def request(self, count):
+        """Ask for the first count lines to be read, without waiting"""
+        with self._cond:
+            if count > self._wanted:
+                self._wanted = count
+                self._cond.notify_all()
+
+    def wait_for(self, count):
+        """Ask for count lines and block until they are read.
+
+        Returns early if the stream ends or the reader is stopped.
+        """
+        with self._cond:
+            if count > self._wanted:
+                self._wanted = count
+                self._cond.notify_all()
+            while not self.finished and not self._stopped \
+                    and len(self.lines) < count:
+                self._cond.wait()
+
+    def wait(self):
+        """Block until the reader is paused or finished"""
+        with self._cond:
+            while not self.finished and self._want_more():
+                self._cond.wait()
+
+    def stop(self):
+        """Stop reading.  The reader closes the stream when it wakes up."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    self._cond.notify_all()  # for wait()
+                    while not self._want_more() and not self._stopped:
+                        self._cond.wait()
+                    if self._stopped:
+                        break
+                line = self.stream.readline()
+                if not line:
+                    break
+                self.lines.append(line)
+                self.max_length = max(self.max_length, len(line))
+                if self.on_update is not None:
+                    self.on_update()
+        except (OSError, ValueError, UnicodeError):
+            pass
+        finally:
+            try:
+                self.stream.close()
+            except OSError:
+                pass
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+            if self.on_update is not None:
+                self.on_update()
@@ -1,19 +1,27 @@
 # -*- encoding: utf-8 -*-
 
+from functools import lru_cache
 from unicodedata import east_asian_width
 
-# from .. import PY3
-
-ASCIIONLY = set(chr(c) for c in range(1, 128))
 NARROW = 1
 WIDE = 2
 WIDE_SYMBOLS = set('WF')
+WIDTH_CACHE_SIZE = 4096
 
 
 def uwid(string):
-    """Return the width of a string"""
-    if not PY3:
-        string = string.decode('utf-8', 'ignore')
+    """Return the width of a string
+
+    >>> uwid("poo"), uwid("モヒカン")
+    (3, 8)
+    """
+    if string.isascii():
+        return len(string)
+    return _wide_uwid(string)
+
+
+@lru_cache(maxsize=WIDTH_CACHE_SIZE)
+def _wide_uwid(string):
     return sum(utf_char_width(c) for c in string)
 
 
@@ -26,41 +34,35 @@ def utf_char_width(string):
 
 def string_to_charlist(string):
     """Return a list of characters with extra empty strings after wide chars"""
-    if not set(string) - ASCIIONLY:
+    if string.isascii():
         return list(string)
     result = []
-    if PY3:
-        for char in string:
-            result.append(char)
-            if east_asian_width(char) in WIDE_SYMBOLS:
-                result.append('')
-    else:
-        try:
-            # This raised a "UnicodeEncodeError: 'ascii' codec can't encode
-            # character u'\xe4' in position 10: ordinal not in range(128)"
-            # for me once.  I thought errors='ignore' means IGNORE THE DAMN
-            # ERRORS but apparently it doesn't.
-            string = string.decode('utf-8', 'ignore')
-        except UnicodeEncodeError:
-            return []
-        for char in string:
-            result.append(char.encode('utf-8'))
-            if east_asian_width(char) in WIDE_SYMBOLS:
-                result.append('')
+    for char in string:
+        result.append(char)
+        if east_asian_width(char) in WIDE_SYMBOLS:
+            result.append('')
     return result
 
 
 class WideString(object):
 
+    """A string that is measured and sliced in terminal cells
+
+    Wide (e.g. CJK) characters take two cells.  The list of cells, chars,
+    is only built when it is asked for; lengths and slices work on the
+    string itself, with a shortcut for pure ASCII strings.
+    """
+
     def __init__(self, string, chars=None):
-        try:
-            self.string = str(string)
-        except UnicodeEncodeError:      # FIXME: UnicodeEncodeEror
-            self.string = string.encode('latin-1', 'ignore')
-        if chars is None:
-            self.chars = string_to_charlist(string)
-        else:
-            self.chars = chars
+        self.string = str(string)
+        self._chars = chars
+
+    @property
+    def chars(self):
+        """The characters, with an empty string after each wide one"""
+        if self._chars is None:
+            self._chars = string_to_charlist(self.string)
+        return self._chars
 
     def __add__(self, string):
         """
@@ -74,7 +76,7 @@ class WideString(object):
         if isinstance(string, str):
             return WideString(self.string + string)
         elif isinstance(string, WideString):
-            return WideString(self.string + string.string, self.chars + string.chars)
+            return WideString(self.string + string.string)
         return None
 
     def __radd__(self, string):
@@ -85,7 +87,7 @@ class WideString(object):
         if isinstance(string, str):
             return WideString(string + self.string)
         elif isinstance(string, WideString):
-            return WideString(string.string + self.string, string.chars + self.chars)
+            return WideString(string.string + self.string)
         return None
 
     def __str__(self):
@@ -116,22 +118,39 @@ class WideString(object):
         <WideString 'a '>
         >>> WideString("aモ")[0:1]
         <WideString 'a'>
+        >>> WideString("モab")[1:4]
+        <WideString ' ab'>
+        >>> WideString("ab")[3:5]
+        <WideString ''>
         """
-        if stop is None or stop > len(self.chars):
-            stop = len(self.chars)
+        string = self.string
+        width = len(self)
+        if stop is None or stop > width:
+            stop = width
         if stop < 0:
-            stop = len(self.chars) + stop
-        if stop < 0:
-            return WideString("")
+            stop = width + stop
         if start is None or start < 0:
             start = 0
-        if stop < len(self.chars) and self.chars[stop] == '':
-            if self.chars[start] == '':
-                return WideString(' ' + ''.join(self.chars[start:stop - 1]) + ' ')
-            return WideString(''.join(self.chars[start:stop - 1]) + ' ')
-        if self.chars[start] == '':
-            return WideString(' ' + ''.join(self.chars[start:stop - 1]))
-        return WideString(''.join(self.chars[start:stop]))
+        if stop <= start:
+            return WideString("")
+        if string.isascii():
+            return WideString(string[start:stop])
+
+        # Walk the string by cells; a wide char that is cut in half at
+        # either end is replaced by a space.
+        result = []
+        pos = 0
+        for char in string:
+            end = pos + utf_char_width(char)
+            if end > start:
+                if pos >= stop:
+                    break
+                if pos < start or end > stop:
+                    result.append(' ')
+                else:
+                    result.append(char)
+            pos = end
+        return WideString(''.join(result))
 
     def __getitem__(self, i):
         """
@@ -153,4 +172,4 @@ class WideString(object):
         >>> len(WideString("モヒカン"))
         8
         """
-        return len(self.chars)
+        return uwid(self.string)
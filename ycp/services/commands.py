@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""The base class of console commands and the container that holds them.
+
+A command is a subclass of Command whose name is the lower-case class
+name.  Typing ":name arg1 arg2" into the console (or binding the line to
+a key) instantiates the class with the line and calls execute().
+"""
+
+from .shared import VideoManagerAware, SettingsAware
+
+
+class Command(VideoManagerAware, SettingsAware):
+    """Abstract base class of all console commands."""
+
+    name = None
+    allow_abbrev = True
+    # Whether key repeats of the command may be run as one, with the
+    # quantifiers added up.  True for motions.
+    coalesce = False
+
+    def __init__(self, line, quantifier=None):
+        self.line = line
+        self.args = line.split()
+        self.quantifier = quantifier
+        self.quickly_executed = False
+
+    @classmethod
+    def get_name(cls):
+        return cls.name or cls.__name__.lower()
+
+    def execute(self):
+        """Override this"""
+
+    def tab(self, tabnum):
+        """Override this"""
+
+    def quick(self):
+        """Override this"""
+
+    def cancel(self):
+        """Override this"""
+
+    def arg(self, n):
+        """Returns the nth space separated word"""
+        try:
+            return self.args[n]
+        except IndexError:
+            return ""
+
+    def rest(self, n):
+        """Returns everything from and after arg(n)
+
+        >>> Command("cmd  one two").rest(1)
+        'one two'
+        """
+        words = self.line.split(None, n)
+        if len(words) > n:
+            return words[n]
+        return ""
+
+
+class CommandContainer:
+    """Holds the Command classes by name."""
+
+    def __init__(self):
+        self.commands = {}
+
+    def __getitem__(self, key):
+        return self.commands[key]
+
+    def register(self, cls):
+        self.commands[cls.get_name()] = cls
+        return cls
+
+    def load_commands_from_module(self, module):
+        for var in vars(module).values():
+            try:
+                if issubclass(var, Command) and var is not Command:
+                    self.register(var)
+            except TypeError:
+                pass
+
+    def get_command(self, name, abbrev=True):
+        if abbrev:
+            matches = [cls for cmd, cls in self.commands.items()
+                       if cmd == name or (cls.allow_abbrev and cmd.startswith(name))]
+            if not matches:
+                raise KeyError(name)
+            if len(matches) == 1:
+                return matches[0]
+            if name in self.commands:
+                return self.commands[name]
+            raise ValueError("Ambiguous command: `%s'" % name)
+        return self.commands[name]
+
+    def command_generator(self, start):
+        return sorted(cmd + ' ' for cmd in self.commands if cmd.startswith(start))
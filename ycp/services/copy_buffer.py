@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+
+class CopyBuffer:
+    """The files that were yanked or cut, waiting to be pasted.
+
+    It can be used like the set of file objects it replaces.  On top of
+    that, paths offers O(1) membership tests by path, and generation grows
+    with every change so widgets can tell when to redraw.
+
+    >>> from collections import namedtuple
+    >>> File = namedtuple('File', 'path')
+    >>> buf = CopyBuffer()
+    >>> buf.update([File('/a'), File('/b')])
+    >>> '/a' in buf.paths, len(buf), buf.generation
+    (True, 2, 1)
+    >>> buf.discard(File('/a'))
+    >>> '/a' in buf.paths, buf.generation
+    (False, 2)
+    """
+
+    def __init__(self, files=()):
+        self._by_path = {fobj.path: fobj for fobj in files}
+        self.generation = 0
+
+    @property
+    def paths(self):
+        return self._by_path.keys()
+
+    def __iter__(self):
+        return iter(list(self._by_path.values()))
+
+    def __len__(self):
+        return len(self._by_path)
+
+    def __contains__(self, fobj):
+        return fobj.path in self._by_path
+
+    def add(self, fobj):
+        self.update((fobj,))
+
+    def update(self, files):
+        before = len(self._by_path)
+        for fobj in files:
+            self._by_path[fobj.path] = fobj
+        if len(self._by_path) != before:
+            self.generation += 1
+
+    def discard(self, fobj):
+        if self._by_path.pop(fobj.path, None) is not None:
+            self.generation += 1
+
+    def clear(self):
+        if self._by_path:
+            self._by_path.clear()
+            self.generation += 1
+
+    def replace(self, files):
+        """Drop the current content and hold files instead"""
+        self._by_path = {fobj.path: fobj for fobj in files}
+        self.generation += 1
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""The main loop of ycp: wait for input, timers and background workers.
+
+Instead of polling, the loop sleeps in select() until one of these is
+ready:
+
+- a file descriptor registered with add_reader(), e.g. stdin,
+- the next timer set with call_later(),
+- a call of wakeup(), which background threads use when they have
+  something new to show,
+- a signal registered with add_signal_handler(), e.g. SIGWINCH.
+
+Callbacks run in the main thread, from run_once().
+"""
+
+import heapq
+import os
+import selectors
+import signal
+from itertools import count
+from time import monotonic
+
+
+class Timer:
+    """A callback scheduled by EventLoop.call_later()"""
+
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop:
+    """Waits for file descriptors, timers, wakeups and signals
+
+    >>> import threading
+    >>> loop = EventLoop()
+    >>> fired = []
+    >>> _ = loop.call_later(0, lambda: fired.append('timer'))
+    >>> cancelled = loop.call_later(0, lambda: fired.append('cancelled'))
+    >>> cancelled.cancel()
+    >>> loop.run_once(); fired
+    ['timer']
+    >>> threading.Thread(target=loop.wakeup).start()
+    >>> loop.run_once(timeout=10); loop.woken
+    True
+    >>> loop.close()
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._timers = []
+        self._sequence = count()
+        self._signals = []
+        self._wakeup_pending = False
+        self.woken = False
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        os.set_blocking(self._wakeup_write, False)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ,
+                                self._read_wakeups)
+
+    def add_reader(self, fd, callback):
+        """Call callback() whenever fd is readable"""
+        self._selector.register(fd, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, fd):
+        try:
+            self._selector.unregister(fd)
+        except KeyError:
+            pass
+
+    def call_later(self, delay, callback):
+        """Call callback() in delay seconds.  Returns a Timer."""
+        timer = Timer(monotonic() + delay, callback)
+        heapq.heappush(self._timers, (timer.when, next(self._sequence), timer))
+        return timer
+
+    def add_signal_handler(self, signum, callback):
+        """Call callback() from the loop after the signal was received"""
+        def handler(_signum, _frame):
+            self._signals.append(callback)
+            self.wakeup()
+        signal.signal(signum, handler)
+
+    def wakeup(self):
+        """Make run_once() return soon.  Safe to call from any thread."""
+        if self._wakeup_pending:
+            return
+        self._wakeup_pending = True
+        try:
+            os.write(self._wakeup_write, b'\0')
+        except (BlockingIOError, OSError):
+            pass  # the pipe is full, so the loop wakes up anyway
+
+    def _read_wakeups(self):
+        self._wakeup_pending = False
+        try:
+            while os.read(self._wakeup_read, 4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        self.woken = True
+
+    def _next_timeout(self, timeout):
+        timers = self._timers
+        while timers and timers[0][2].cancelled:
+            heapq.heappop(timers)
+        if timers:
+            delay = max(0, timers[0][0] - monotonic())
+            timeout = delay if timeout is None else min(timeout, delay)
+        return timeout
+
+    def run_once(self, timeout=None):
+        """Wait for one round of events and run their callbacks
+
+        Without a timeout, this waits until something happens.
+        """
+        self.woken = False
+        for key, _ in self._selector.select(self._next_timeout(timeout)):
+            key.data()
+        while self._signals:
+            self._signals.pop(0)()
+        now = monotonic()
+        timers = self._timers
+        while timers and timers[0][0] <= now:
+            timer = heapq.heappop(timers)[2]
+            if not timer.cancelled:
+                timer.callback()
+
+    def close(self):
+        self._selector.close()
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
@@ -1,5 +1,46 @@
 # -*- coding: utf-8 -*-
 
 
+class Metadata(dict):
+    """The metadata of one file, fields are readable as attributes
+
+    >>> Metadata(title='Solaris').title
+    'Solaris'
+    >>> Metadata().year is None
+    True
+    """
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get(name)
+
+
 class MetadataManager:
-    pass
+    """Holds the metadata (title, year, authors...) of files by path.
+
+    Every path has a version which is bumped whenever its metadata changes,
+    so a cache can store the version instead of hashing the metadata.
+    """
+
+    def __init__(self):
+        self._metadata = {}
+        self._versions = {}
+
+    def get_metadata(self, path):
+        try:
+            return self._metadata[path]
+        except KeyError:
+            return Metadata()
+
+    def set_metadata(self, path, values):
+        """Update the metadata of path with the dict values"""
+        metadata = self._metadata.setdefault(path, Metadata())
+        changed = {key: value for key, value in values.items()
+                   if metadata.get(key) != value}
+        if changed:
+            metadata.update(changed)
+            self._versions[path] = self._versions.get(path, 0) + 1
+
+    def version(self, path):
+        return self._versions.get(path, 0)
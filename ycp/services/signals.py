@@ -99,6 +99,14 @@ class SignalHandler:
         self.pass_signal = pass_signal
         self._activity = activity
 
+    @property
+    def activity(self):
+        return self._activity
+
+    @activity.setter
+    def activity(self, value):
+        self._activity = value
+
 
 class SignalDispatcher:
     """This abstract class handles the binding and emitting of signals."""